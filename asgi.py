@@ -0,0 +1,369 @@
+"""
+ASGI entrypoint cho các endpoint gọi LM Studio.
+
+/chat-stream, /generate-recipe và /generate-recipe-stream chạy trên asyncio với
+AsyncOpenAI nên một process giữ được hàng trăm stream cùng lúc thay vì bị giới hạn
+bởi số thread. WebSocket /detect-stream nhận chuỗi frame từ camera. Các endpoint còn
+lại (detect, classes, session, health...) được chuyển tiếp tới Flask app trong main.py,
+chạy trên thread pool của WSGI adapter.
+
+Chạy: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextlib
+
+import anyio
+import httpx
+from a2wsgi import WSGIMiddleware
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import main
+import sse
+from main import (
+    FALLBACK_WORD_DELAY,
+    SSE_HEADERS,
+    DetectionStream,
+    LLMBusyError,
+    LLMTimings,
+    build_chat_context,
+    busy_payload,
+    cached_recipe_events,
+    canonical_ingredients,
+    chat_completion,
+    chat_done_event,
+    chat_stream_cancelled,
+    decode_image,
+    error_event,
+    fallback_done_event,
+    fallback_events,
+    frame_coalescer,
+    llm_error_message,
+    llm_error_payload,
+    llm_gateway,
+    logger,
+    parse_recipe_request,
+    recipe_cache,
+    recipe_cache_key,
+    recipe_completion,
+    recipe_done_event,
+    recipe_flights,
+    recipe_result,
+    request_logger,
+    requests_total,
+    save_chat_message,
+    server_error_payload,
+    stage_seconds,
+    touch_chat_session,
+)
+
+WSGI_WORKERS = 32  # Số thread chạy các endpoint Flask (detect, session, health...)
+
+async_client = AsyncOpenAI(
+    base_url=main.LM_STUDIO_URL,
+    api_key="lm-studio",  # Chỉ là chuỗi giả
+    timeout=main.LLM_TIMEOUT,
+    http_client=httpx.AsyncClient(limits=main.LLM_POOL_LIMITS)
+)
+
+def counted(handler):
+    """Đếm request cho các route async (route Flask đã được đếm trong after_request)"""
+    async def wrapper(request):
+        response = await handler(request)
+        requests_total.inc(request.url.path, request.method, str(response.status_code))
+        return response
+    return wrapper
+
+def busy_response(busy):
+    """Response 429/503 khi LM Studio quá tải"""
+    return JSONResponse(busy_payload(busy), status_code=busy.status, headers={'Retry-After': str(busy.retry_after)})
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+# ==================== LM STUDIO RECIPE API ====================
+
+async def get_cached_recipe(cache_key):
+    """LRU trong RAM đọc trực tiếp; chỉ khi trượt mới đọc SQLite trên thread pool"""
+    recipe = recipe_cache.memory.get(cache_key)
+    if recipe is None and recipe_cache.db is not None:
+        recipe = await run_in_threadpool(recipe_cache.load, cache_key)
+    return recipe
+
+async def store_recipe(cache_key, recipe):
+    recipe_cache.memory.set(cache_key, recipe)
+    if recipe_cache.db is not None:
+        await run_in_threadpool(recipe_cache.persist, cache_key, recipe)
+
+async def produce_recipe(flight, ingredients, cache_key):
+    """Gọi LM Studio (stream) cho một flight, publish từng chunk và lưu cache khi xong"""
+    with await llm_gateway.acquire_async('recipe'):
+        flight.admit()
+        timings = LLMTimings()
+        response = await async_client.chat.completions.create(**recipe_completion(ingredients))
+        async for chunk in response:
+            content = timings.delta(chunk)
+            if content:
+                flight.publish(content)
+        timings.finish()
+    recipe = flight.text()
+    if recipe:
+        await store_recipe(cache_key, recipe)
+
+def join_recipe_flight(ingredients, cache_key):
+    """Trả về (flight, leader): request trùng nguyên liệu dùng chung một lời gọi LM Studio"""
+    return recipe_flights.run_async(cache_key, lambda flight: produce_recipe(flight, ingredients, cache_key))
+
+async def generate_recipe(request):
+    """Tạo công thức từ nguyên liệu (async)"""
+    try:
+        ingredients, error = parse_recipe_request(await read_json(request))
+        if error:
+            return JSONResponse(error, status_code=400)
+
+        cache_key = recipe_cache_key(ingredients)
+        cached_recipe = await get_cached_recipe(cache_key)
+        if cached_recipe is not None:
+            return JSONResponse({'success': True, **recipe_result(cached_recipe, ingredients, cached=True)})
+
+        try:
+            flight, leader = join_recipe_flight(ingredients, cache_key)
+            request_logger.info("🤖 %s LM Studio API (async)...", 'Calling' if leader else 'Joining in-flight call to')
+            recipe = await flight.aresult()
+            request_logger.info("✅ Recipe generated successfully")
+            return JSONResponse({'success': True, **recipe_result(recipe, ingredients, cached=False, leader=leader)})
+
+        except LLMBusyError as busy:
+            return busy_response(busy)
+        except Exception as api_error:
+            return JSONResponse(llm_error_payload(api_error), status_code=503)
+
+    except Exception as e:
+        logger.error("❌ Generate recipe error: %s", e)
+        return JSONResponse(server_error_payload(e), status_code=500)
+
+async def generate_recipe_stream(request):
+    """Tạo công thức với streaming response (async)"""
+    data = await read_json(request) or {}
+    ingredients = canonical_ingredients(data.get('ingredients') or [])
+    cache_key = recipe_cache_key(ingredients)
+    cached_recipe = await get_cached_recipe(cache_key) if ingredients else None
+    # Chờ lời gọi LM Studio (của request này hoặc request trùng nguyên liệu) qua hàng đợi
+    # trước khi trả header, để có thể trả về 429/503
+    flight, leader = None, True
+    if ingredients and cached_recipe is None:
+        flight, leader = join_recipe_flight(ingredients, cache_key)
+        try:
+            await flight.await_admitted()
+        except LLMBusyError as busy:
+            return busy_response(busy)
+
+    async def generate_response():
+        try:
+            if not ingredients:
+                yield error_event('No ingredients provided')
+                return
+            if cached_recipe is not None:
+                for frame in cached_recipe_events(cached_recipe, ingredients):
+                    yield frame
+                return
+            try:
+                frames = frame_coalescer()
+                async for frame in sse.astream_frames(flight.astream(), frames):
+                    yield frame
+                yield recipe_done_event(frames, ingredients, leader)
+            except Exception as api_error:
+                yield error_event(llm_error_message(api_error))
+        except Exception as e:
+            logger.error("❌ Generate recipe stream error: %s", e)
+            yield error_event(str(e))
+
+    return StreamingResponse(generate_response(), media_type=sse.MEDIA_TYPE, headers=SSE_HEADERS)
+
+# ==================== CHAT API WITH CONTEXT & STREAMING ====================
+
+async def chat_stream(request):
+    """Chat với streaming response và context memory (async)"""
+    data = await read_json(request) or {}
+    session_id = data.get('session_id')
+    question = data.get('question', '')
+    permit = None
+    if session_id and question:
+        try:
+            permit = await llm_gateway.acquire_async('chat')
+        except LLMBusyError as busy:
+            return busy_response(busy)
+
+    async def generate_response():
+        try:
+            if not session_id or not question:
+                yield error_event('Missing session_id or question')
+                return
+            # Session store có thể gọi Redis/SQLite: chạy trên thread pool, không chặn event loop
+            session = await run_in_threadpool(touch_chat_session, session_id)
+            if session is None:
+                yield error_event('Session not found or expired')
+                return
+            context_messages, prompt_tokens = build_chat_context(session, question)
+            request_logger.info("🤖 Streaming chat - Session: %s, Prompt tokens: ~%d", session_id, prompt_tokens)
+            timings = LLMTimings()
+            try:
+                response = await async_client.chat.completions.create(**chat_completion(context_messages))
+                async def deltas():
+                    async for chunk in response:
+                        content = timings.delta(chunk)
+                        if content:
+                            yield content
+
+                frames = frame_coalescer()
+                frame_stream = sse.astream_frames(deltas(), frames)
+                try:
+                    async for frame in frame_stream:
+                        yield frame
+                except (GeneratorExit, asyncio.CancelledError):
+                    chat_stream_cancelled(session_id)
+                    raise
+                finally:
+                    # Đóng kết nối tới LM Studio để nó dừng sinh token (kể cả khi task đang bị hủy)
+                    with anyio.CancelScope(shield=True):
+                        await frame_stream.aclose()
+                        await response.close()
+                timings.finish()
+                full_answer = frames.text().strip()
+                await run_in_threadpool(save_chat_message, session_id, question, full_answer)
+                yield chat_done_event(full_answer, prompt_tokens, frames)
+            except Exception as api_error:
+                logger.error("❌ LM Studio API error: %s", api_error)
+                fallback_answer, chunks = fallback_events(question)
+                for frame in chunks:
+                    yield frame
+                    await asyncio.sleep(FALLBACK_WORD_DELAY)  # Delay không chiếm thread
+                await run_in_threadpool(save_chat_message, session_id, question, fallback_answer, touch=False)
+                yield fallback_done_event(fallback_answer)
+        except Exception as e:
+            logger.error("❌ Chat stream error: %s", e)
+            yield error_event(str(e))
+        finally:
+            if permit:
+                permit.release()
+
+    return StreamingResponse(generate_response(), media_type=sse.MEDIA_TYPE, headers=SSE_HEADERS,
+                             background=BackgroundTask(permit.release) if permit else None)
+
+# ==================== STREAMING DETECTION ====================
+
+async def detect_stream(websocket):
+    """
+    Detect nguyên liệu từ chuỗi frame (WebSocket).
+    Client gửi mỗi frame là một message binary (JPEG/PNG), gửi text "end" để kết thúc.
+    Server gửi {"type": "update", ...} mỗi khi danh sách nguyên liệu thay đổi và
+    {"type": "summary", ...} khi kết thúc. Frame đến lúc model đang bận chỉ giữ frame mới nhất.
+    """
+    await websocket.accept()
+    if not main.model_loaded:
+        if main.model_state['status'] == 'loading':
+            # 1013 = Try Again Later: model vẫn đang load trên thread nền
+            await websocket.send_json({'type': 'error', 'status': 'warming_up',
+                                       'error': 'YOLO model is warming up, please retry shortly',
+                                       'retry_after': main.YOLO_LOADING_RETRY_AFTER})
+            await websocket.close(code=1013)
+        else:
+            await websocket.send_json({'type': 'error', 'error': 'YOLO model not loaded'})
+            await websocket.close(code=1011)
+        return
+
+    stream = DetectionStream()
+    max_frame_bytes = main.app.config['MAX_CONTENT_LENGTH']
+    pending = {'frame': None, 'closed': False}
+    wakeup = asyncio.Event()
+
+    async def process_frames():
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            frame = pending['frame']
+            pending['frame'] = None
+            if frame is None:
+                if pending['closed']:
+                    return
+                continue
+            index, data = frame
+            try:
+                with stage_seconds.time('stream_frame'):
+                    changed = await run_in_threadpool(stream.changed, data)
+                    if not changed:
+                        stream.count('skipped')
+                        continue
+                    image = await run_in_threadpool(decode_image, data)
+                    detections = await asyncio.wrap_future(main.detector.submit(image, conf=main.DETECT_CONF))
+                    stream.count('processed')
+                    update = stream.update(detections)
+                if update is not None:
+                    await websocket.send_json({'type': 'update', 'frame': index, **update})
+            except Exception as e:
+                logger.error("❌ Stream frame error: %s", e)
+                await websocket.send_json({'type': 'error', 'frame': index, 'error': str(e)})
+            finally:
+                if pending['frame'] is not None or pending['closed']:
+                    wakeup.set()
+
+    worker = asyncio.create_task(process_frames())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(message.get('code', 1000))
+            data = message.get('bytes')
+            if data is None:
+                if (message.get('text') or '').strip() == 'end':
+                    break
+                continue
+            stream.count('received')
+            if len(data) > max_frame_bytes:
+                await websocket.send_json({'type': 'error', 'frame': stream.frames['received'], 'error': 'Frame too large'})
+                continue
+            if pending['frame'] is not None:
+                # Model chưa xử lý kịp: bỏ frame cũ, chỉ giữ frame mới nhất
+                stream.count('dropped')
+            pending['frame'] = (stream.frames['received'], data)
+            wakeup.set()
+        pending['closed'] = True
+        wakeup.set()
+        await worker
+        await websocket.send_json({'type': 'summary', **stream.snapshot(), 'stats': stream.stats()})
+        await websocket.close()
+    except WebSocketDisconnect:
+        worker.cancel()
+    request_logger.info("🎥 Detect stream finished: %s", stream.stats())
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Model/worker pool và các thread nền chỉ chạy trong process phục vụ (không chạy khi import)
+    main.start_background_services()
+    yield
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route('/generate-recipe', counted(generate_recipe), methods=['POST']),
+        Route('/generate-recipe-stream', counted(generate_recipe_stream), methods=['POST']),
+        Route('/chat-stream', counted(chat_stream), methods=['POST']),
+        WebSocketRoute('/detect-stream', detect_stream),
+        Mount('/', app=WSGIMiddleware(main.app, workers=WSGI_WORKERS)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,119 @@
+"""
+Benchmark post-processing kết quả YOLO: vòng lặp từng box (cách cũ) so với xử lý trên mảng.
+
+Chạy từ thư mục gốc: python benchmarks/bench_postprocess.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+class _Array:
+    """Giả lập tensor của ultralytics (hỗ trợ .cpu().numpy(), index và .item())"""
+
+    def __init__(self, values):
+        self.values = values
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+    def __getitem__(self, index):
+        return _Array(self.values[index])
+
+    def item(self):
+        return self.values.item()
+
+    def __len__(self):
+        return len(self.values)
+
+
+class _Box:
+    def __init__(self, class_id, confidence):
+        self.cls = _Array(np.array([class_id], dtype=np.float32))
+        self.conf = _Array(np.array([confidence], dtype=np.float32))
+
+
+class _Boxes:
+    def __init__(self, class_ids, confidences):
+        self.cls = _Array(class_ids)
+        self.conf = _Array(confidences)
+
+    def __len__(self):
+        return len(self.cls)
+
+    def __iter__(self):
+        for class_id, confidence in zip(self.cls.values, self.conf.values):
+            yield _Box(class_id, confidence)
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+def legacy_postprocess(results, names):
+    """Cách xử lý cũ trong detect_ingredients: lặp từng box rồi gộp bằng dict"""
+    detailed_results = []
+    for result in results:
+        for box in result.boxes:
+            class_id = int(box.cls[0].item())
+            confidence = float(box.conf[0].item())
+            if class_id in names:
+                detailed_results.append({'name': names[class_id], 'confidence': confidence, 'class_id': class_id})
+    unique_ingredients = {}
+    for item in detailed_results:
+        name = item['name']
+        if name not in unique_ingredients or item['confidence'] > unique_ingredients[name]['confidence']:
+            unique_ingredients[name] = item
+    sorted_results = sorted(unique_ingredients.values(), key=lambda x: x['confidence'], reverse=True)
+    return [main.datamap(item['name']) for item in sorted_results]
+
+
+def timeit(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def run():
+    names = {i: name for i, name in enumerate([
+        "carrot", "chicken", "tomato", "ginger", "beans", "banana", "sponge_gourd", "onion", "garlic",
+        "bell_pepper", "egg", "avocado", "beet", "apple", "lemon", "broccoli", "bitter_gourd", "chillies",
+        "fish", "corn", "okra", "eggplant", "beef", "cucumber", "potato", "cabbage", "cauliflower", "cheese",
+        "shrimp", "kimchi", "lettuce", "mushroom", "sausage", "coriander", "pineapple", "lime", "papaya",
+        "pork", "dragon_fruit", "pumpkin", "pear", "guava", "calabash", "watermelon", "turmeric"
+    ])}
+    registry = main.ClassRegistry(names)
+    # Chờ thread load model ghi class_* xong rồi mới thay bằng bảng của benchmark
+    main.wait_for_model()
+    main.class_known, main.class_names_en, main.class_names_vi = registry.known, registry.english, registry.vietnamese
+    rng = np.random.default_rng(0)
+
+    print(f"{'boxes':>8} {'legacy (ms)':>12} {'vectorized (ms)':>16} {'speedup':>8}")
+    for box_count in (10, 100, 500, 1000, 5000):
+        class_ids = rng.integers(0, len(names), box_count).astype(np.float32)
+        confidences = rng.uniform(main.DETECT_CONF, 1.0, box_count).astype(np.float32)
+        results = [_Result(_Boxes(class_ids, confidences))]
+
+        expected = legacy_postprocess(results, names)
+        actual = main.postprocess_results(results)['ingredients']
+        assert expected == actual, "Kết quả hai cách xử lý khác nhau (nguyên liệu hoặc thứ tự)"
+
+        repeat = max(5, 20000 // box_count)
+        legacy = timeit(lambda: legacy_postprocess(results, names), repeat)
+        vectorized = timeit(lambda: main.postprocess_results(results), repeat)
+        print(f"{box_count:>8} {legacy * 1000:>12.3f} {vectorized * 1000:>16.3f} {legacy / vectorized:>7.1f}x")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,76 @@
+"""
+So sánh model đã export (YOLO_BACKEND=onnx/openvino) với model .pt gốc trên ảnh mẫu:
+nguyên liệu phát hiện được, chênh lệch confidence và tốc độ (ảnh/giây).
+
+Chạy từ thư mục gốc: YOLO_BACKEND=onnx python benchmarks/check_export_accuracy.py [thư mục ảnh]
+"""
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+MAX_CONFIDENCE_DIFF = 0.05  # Chênh lệch confidence tối đa chấp nhận được
+
+
+def detect(model, images):
+    """Chạy từng ảnh, trả về ({english_name: confidence} mỗi ảnh, ảnh/giây)"""
+    detections = []
+    started = time.perf_counter()
+    for image in images:
+        results = model(image, conf=main.DETECT_CONF, imgsz=main.YOLO_IMGSZ, verbose=False)
+        payload = main.postprocess_results(results)
+        detections.append({item['english_name']: item['confidence'] for item in payload['detailed_results']})
+    return detections, len(images) / (time.perf_counter() - started)
+
+
+def run(image_dir):
+    if not main.wait_for_model():
+        print(f"❌ YOLO model not loaded: {main.model_state['error']}")
+        return 1
+    if main.YOLO_BACKEND == 'pytorch':
+        print("⚠️ YOLO_BACKEND=pytorch, không có bản export để so sánh")
+        return 1
+
+    paths = sorted(glob.glob(os.path.join(image_dir, '*.jpg')) + glob.glob(os.path.join(image_dir, '*.png')))
+    if not paths:
+        print(f"❌ Không có ảnh trong {image_dir}")
+        return 1
+    images = [main.decode_image(open(path, 'rb').read()) for path in paths]
+
+    reference_model = main.load_yolo_model(backend='pytorch')
+    main.warmup_yolo_model(reference_model)
+    reference, reference_speed = detect(reference_model, images)
+    candidate_model = main.yolo_model
+    if candidate_model is None:
+        # DETECT_WORKERS > 0: model chỉ nằm trong các worker, load bản export ở đây
+        candidate_model = main.load_yolo_model()
+        main.warmup_yolo_model(candidate_model)
+    candidate, candidate_speed = detect(candidate_model, images)
+
+    failures = 0
+    max_diff = 0.0
+    for path, expected, actual in zip(paths, reference, candidate):
+        missing = sorted(set(expected) - set(actual))
+        extra = sorted(set(actual) - set(expected))
+        diffs = [abs(expected[name] - actual[name]) for name in set(expected) & set(actual)]
+        image_diff = max(diffs, default=0.0)
+        max_diff = max(max_diff, image_diff)
+        ok = not missing and not extra and image_diff <= MAX_CONFIDENCE_DIFF
+        failures += not ok
+        status = '✅' if ok else '❌'
+        print(f"{status} {os.path.basename(path)}: max conf diff {image_diff:.4f}"
+              f"{f', missing {missing}' if missing else ''}{f', extra {extra}' if extra else ''}")
+
+    print(f"\nBackend: {main.YOLO_BACKEND} (imgsz={main.YOLO_IMGSZ}, half={main.YOLO_HALF}, int8={main.YOLO_INT8})")
+    print(f"Ảnh khớp: {len(paths) - failures}/{len(paths)}, max conf diff: {max_diff:.4f}")
+    print(f"Tốc độ: pytorch {reference_speed:.1f} ảnh/s, {main.YOLO_BACKEND} {candidate_speed:.1f} ảnh/s")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    default_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images')
+    sys.exit(run(sys.argv[1] if len(sys.argv) > 1 else default_dir))
@@ -0,0 +1,101 @@
+"""
+Kiểm tra RedisSessionStore với server Redis giả lập local (fakeredis, không cần Redis thật):
+chạy cùng một kịch bản trên backend memory và redis rồi so sánh kết quả.
+
+Chạy từ thư mục gốc: python benchmarks/check_redis_store.py [--url redis://host:6379/15]
+(cần pip install redis fakeredis; --url để chạy với server Redis có sẵn, dữ liệu test bị xóa sau khi chạy)
+"""
+import argparse
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import create_session_store  # noqa: E402
+
+HISTORY_SIZE = 3
+
+
+def start_fake_redis(port=16399):
+    """Chạy fakeredis.TcpFakeServer trên thread nền, trả về (server, URL)"""
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    server.daemon_threads = True  # Thread của từng kết nối không giữ process lại khi thoát
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"redis://127.0.0.1:{port}/0"
+
+
+def message(i):
+    return {'question': f'câu hỏi {i}', 'answer': f'trả lời {i}', 'timestamp': datetime.now().isoformat()}
+
+
+def scenario(store):
+    """Các thao tác main.py dùng, trả về danh sách (tên bước, kết quả) để so sánh giữa các backend"""
+    now = datetime.now()
+    results = []
+    store.create({'session_id': 'a', 'ingredients': ['gà', 'cà chua'], 'recipe': 'Gà sốt cà',
+                  'messages': [], 'created_at': now, 'last_activity': now})
+    # /start-chat với "recipe": null
+    store.create({'session_id': 'b', 'ingredients': [], 'recipe': None,
+                  'messages': [], 'created_at': now, 'last_activity': now})
+    results.append(('count', store.count()))
+    results.append(('touch missing', store.touch('missing')))
+    results.append(('append missing', store.append_message('missing', message(0))))
+    for i in range(HISTORY_SIZE + 2):
+        store.append_message('a', message(i))
+    session = store.touch('a')
+    results.append(('ingredients', session['ingredients']))
+    results.append(('recipe', session['recipe']))
+    results.append(('recent', [m.question for m in session['messages'].recent(HISTORY_SIZE)]))
+    results.append(('recipe null', store.get('b')['recipe'] or ''))
+    results.append(('list', sorted((s['session_id'], s['ingredients_count']) for s in store.list_sessions())))
+    store.touch('b')
+    results.append(('page 1', [(s['session_id'], s['messages_count']) for s in store.list_sessions(0, 1)]))
+    results.append(('page 2', [(s['session_id'], s['messages_count']) for s in store.list_sessions(1, 1)]))
+    results.append(('page 3', store.list_sessions(2, 1)))
+    results.append(('expire none', store.expire(now - timedelta(hours=1))))
+    results.append(('delete', store.delete('b')))
+    results.append(('delete again', store.delete('b')))
+    results.append(('get deleted', store.get('b')))
+    results.append(('expire all', store.expire(datetime.now() + timedelta(seconds=1))))
+    results.append(('count after expire', store.count()))
+    return results
+
+
+def run(url=None):
+    server = None
+    if not url:
+        try:
+            server, url = start_fake_redis()
+        except ImportError:
+            print("❌ Cần pip install fakeredis (hoặc chạy với --url tới server Redis)")
+            return 1
+    expected = scenario(create_session_store('memory', history_size=HISTORY_SIZE))
+    redis_store = create_session_store('redis', redis_url=url, history_size=HISTORY_SIZE,
+                                       prefix='food-app:check:')
+    try:
+        actual = scenario(redis_store)
+    finally:
+        for key in redis_store.redis.scan_iter('food-app:check:*'):
+            redis_store.redis.delete(key)
+        redis_store.redis.close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    failures = 0
+    for (step, want), (_, got) in zip(expected, actual):
+        ok = want == got
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {step}: {got!r}" + ('' if ok else f" (memory: {want!r})"))
+    print(f"\nRedis backend ({url}): {len(expected) - failures}/{len(expected)} bước khớp với memory backend")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check RedisSessionStore against the memory backend')
+    parser.add_argument('--url', help='Server Redis có sẵn (mặc định: fakeredis chạy local)')
+    sys.exit(run(parser.parse_args().url))
@@ -0,0 +1,157 @@
+"""
+Server giả lập LM Studio (API tương thích OpenAI) để benchmark offline.
+
+Hỗ trợ GET /v1/models và POST /v1/chat/completions (stream và không stream).
+Mỗi completion chờ --latency-ms trước token đầu tiên, sau đó sinh --tokens token
+với tốc độ --token-rate token/giây. --slots giới hạn số completion chạy cùng lúc
+(LM Studio chỉ xử lý được vài request song song), request khác phải chờ.
+
+Chạy riêng: python benchmarks/fake_lm_studio.py --port 1234 --token-rate 50
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("Thịt gà rửa sạch, ướp với muối, tiêu và tỏi băm trong mười lăm phút. "
+         "Phi thơm hành, cho gà vào xào săn rồi thêm cà chua, nêm nếm vừa ăn. ").split()
+
+MODEL_ID = 'fake-lm-studio'
+
+
+class FakeLMStudio(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=200, token_rate=50, tokens=120, slots=4):
+        super().__init__(address, _Handler)
+        self.latency = latency_ms / 1000.0
+        self.token_interval = 1.0 / token_rate if token_rate > 0 else 0
+        self.tokens = tokens
+        self.slots = threading.BoundedSemaphore(slots) if slots > 0 else None
+        self.completions = 0
+        self.lock = threading.Lock()
+
+    def generate(self, max_tokens=None):
+        """Sinh token theo latency/tốc độ đã cấu hình (giữ một slot trong lúc sinh)"""
+        count = min(self.tokens, max_tokens) if max_tokens else self.tokens
+        if self.slots:
+            self.slots.acquire()
+        try:
+            with self.lock:
+                self.completions += 1
+            time.sleep(self.latency)
+            for i in range(count):
+                if i and self.token_interval:
+                    time.sleep(self.token_interval)
+                yield WORDS[i % len(WORDS)] + ' '
+        finally:
+            if self.slots:
+                self.slots.release()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive để client dùng lại kết nối trong pool
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        # Transfer-Encoding: chunked
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json({'object': 'list', 'data': [{'id': MODEL_ID, 'object': 'model', 'owned_by': 'bench'}]})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json({'error': 'not found'}, 404)
+            return
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = request.get('model') or MODEL_ID
+        tokens = self.server.generate(request.get('max_tokens'))
+
+        if not request.get('stream'):
+            text = ''.join(tokens)
+            self._send_json({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(text.split()), 'total_tokens': len(text.split())}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def event(delta, finish_reason=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+            }
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+        try:
+            event({'role': 'assistant', 'content': ''})
+            for token in tokens:
+                event({'content': token})
+            event({}, 'stop')
+            self._write_chunk(b'data: [DONE]\n\n')
+            self._write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            # Client hủy stream: dừng sinh token và trả slot
+            tokens.close()
+            self.close_connection = True
+
+
+def start(port=1234, host='127.0.0.1', **options):
+    """Chạy server trên thread nền, trả về server (server.shutdown() để dừng)"""
+    server = FakeLMStudio((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake LM Studio (OpenAI-compatible) server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1234)
+    parser.add_argument('--latency-ms', type=float, default=200, help='Thời gian tới token đầu tiên')
+    parser.add_argument('--token-rate', type=float, default=50, help='Token/giây mỗi completion (0 = không giới hạn)')
+    parser.add_argument('--tokens', type=int, default=120, help='Số token mỗi completion')
+    parser.add_argument('--slots', type=int, default=4, help='Số completion chạy cùng lúc (0 = không giới hạn)')
+    args = parser.parse_args()
+    server = FakeLMStudio((args.host, args.port), latency_ms=args.latency_ms, token_rate=args.token_rate,
+                          tokens=args.tokens, slots=args.slots)
+    print(f"🤖 Fake LM Studio on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
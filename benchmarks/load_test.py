@@ -0,0 +1,384 @@
+"""
+Load test các endpoint chính, chạy offline: LM Studio được thay bằng benchmarks/fake_lm_studio.py,
+YOLO bằng model giả trong benchmarks/stubs (hoặc model thật với --yolo real).
+
+Mỗi kịch bản (detect, recipe, chat, health) chạy riêng với --concurrency client song song,
+in ra throughput, latency p50/p95/p99 và time-to-first-token (endpoint stream), rồi lưu
+kết quả JSON vào benchmarks/results/ để so sánh giữa các lần chạy (--compare).
+
+Chạy từ thư mục gốc:
+    python benchmarks/load_test.py --server asgi --concurrency 16 --requests 200
+    python benchmarks/load_test.py --compare benchmarks/results/<lần trước>.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import httpx
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_lm_studio  # noqa: E402
+
+SCENARIOS = ('health', 'detect', 'recipe', 'chat')
+INGREDIENTS = ['Thịt gà', 'Cà chua', 'Hành tây', 'Tỏi', 'Trứng', 'Cà rốt', 'Bắp cải', 'Nấm', 'Tôm', 'Thịt bò']
+QUESTIONS = ['Nấu món này mất bao lâu?', 'Nên dùng lửa thế nào?', 'Có mẹo gì để ngon hơn không?', 'Đủ cho mấy người ăn?']
+
+
+# ==================== SERVER ====================
+
+def start_app(server, port, llm_url, yolo, env_overrides):
+    """Chạy API (Flask hoặc uvicorn asgi:app) trong process riêng"""
+    env = dict(os.environ, LM_STUDIO_URL=llm_url, LOG_LEVEL='WARNING', **env_overrides)
+    if yolo == 'stub':
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.join(ROOT, 'benchmarks', 'stubs'), env.get('PYTHONPATH')]))
+    if server == 'flask':
+        command = [sys.executable, '-c',
+                   "import logging, main; logging.getLogger('werkzeug').setLevel(logging.WARNING); main.start_background_services(); "
+                   f"main.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning']
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+
+def wait_ready(base_url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"API process exited with code {process.returncode}")
+        try:
+            # Model load trên thread nền sau khi server đã nhận request: chờ tới khi load xong (hoặc lỗi)
+            response = httpx.get(f"{base_url}/health/ready", timeout=1)
+            if response.status_code == 200 or response.json().get('yolo_model_status') == 'failed':
+                return
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"API not ready after {timeout}s")
+
+
+# ==================== REQUESTS ====================
+
+def make_images(count, size):
+    """Ảnh JPEG khác nhau để không trúng cache detect"""
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, 'JPEG', quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def read_stream(response):
+    """Đọc stream data: {...}, trả về (thời điểm chunk đầu tiên, sự kiện cuối)"""
+    first_chunk = None
+    last = None
+    for line in response.iter_lines():
+        if not line.startswith('data: '):
+            continue
+        event = json.loads(line[6:])
+        if event.get('type') == 'chunk' and first_chunk is None:
+            first_chunk = time.perf_counter()
+        last = event
+    return first_chunk, last
+
+
+class Scenario:
+    """Một kịch bản: mỗi client gọi run_one() cho tới khi hết số request"""
+
+    def __init__(self, name, client, options):
+        self.name = name
+        self.client = client
+        self.options = options
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def next_index(self):
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def setup(self, state):
+        pass
+
+    def run_one(self, state):
+        """Trả về (ok, latency, ttft hoặc None)"""
+        raise NotImplementedError
+
+
+class HealthScenario(Scenario):
+    def run_one(self, state):
+        started = time.perf_counter()
+        response = self.client.get('/health')
+        return response.status_code == 200, time.perf_counter() - started, None
+
+
+class DetectScenario(Scenario):
+    def __init__(self, name, client, options):
+        super().__init__(name, client, options)
+        self.images = make_images(options.images, (options.image_width, options.image_height))
+
+    def run_one(self, state):
+        data = self.images[self.next_index() % len(self.images)]
+        started = time.perf_counter()
+        response = self.client.post('/detect', files={'image': ('bench.jpg', data, 'image/jpeg')})
+        ok = response.status_code == 200 and response.json().get('success')
+        return ok, time.perf_counter() - started, None
+
+
+class RecipeScenario(Scenario):
+    def ingredients(self):
+        index = self.next_index()
+        if self.options.recipe_keys:
+            # Lặp lại một số tập nguyên liệu để đo cache/gộp request
+            rng = random.Random(index % self.options.recipe_keys)
+            return rng.sample(INGREDIENTS, 3)
+        return random.sample(INGREDIENTS, 3) + [f'Nguyên liệu {index}-{random.random():.6f}']
+
+    def run_one(self, state):
+        payload = {'ingredients': self.ingredients()}
+        started = time.perf_counter()
+        if not self.options.stream:
+            response = self.client.post('/generate-recipe', json=payload)
+            ok = response.status_code == 200 and response.json().get('success')
+            return ok, time.perf_counter() - started, None
+        with self.client.stream('POST', '/generate-recipe-stream', json=payload) as response:
+            if response.status_code != 200:
+                return False, time.perf_counter() - started, None
+            first_chunk, last = read_stream(response)
+        ttft = first_chunk - started if first_chunk else None
+        return bool(last and last.get('type') == 'done'), time.perf_counter() - started, ttft
+
+
+class ChatScenario(Scenario):
+    def setup(self, state):
+        response = self.client.post('/start-chat', json={
+            'ingredients': random.sample(INGREDIENTS, 3),
+            'recipe': 'Gà xào cà chua: phi tỏi, xào gà, thêm cà chua, nêm vừa ăn.'
+        })
+        state['session_id'] = response.json()['session_id']
+
+    def run_one(self, state):
+        payload = {'session_id': state['session_id'], 'question': random.choice(QUESTIONS)}
+        started = time.perf_counter()
+        with self.client.stream('POST', '/chat-stream', json=payload) as response:
+            if response.status_code != 200:
+                return False, time.perf_counter() - started, None
+            first_chunk, last = read_stream(response)
+        ttft = first_chunk - started if first_chunk else None
+        ok = bool(last and last.get('type') == 'done' and not last.get('note'))  # note = câu trả lời dự phòng
+        return ok, time.perf_counter() - started, ttft
+
+
+SCENARIO_CLASSES = {
+    'health': HealthScenario,
+    'detect': DetectScenario,
+    'recipe': RecipeScenario,
+    'chat': ChatScenario,
+}
+
+
+# ==================== RUNNER ====================
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+    return {'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2)}
+
+
+def run_scenario(scenario, concurrency, total, warmup):
+    latencies, ttfts, errors = [], [], []
+    remaining = [warmup + total]
+    lock = threading.Lock()
+
+    def take():
+        with lock:
+            if remaining[0] <= 0:
+                return None
+            remaining[0] -= 1
+            return remaining[0] >= total  # True = request warm-up, không tính
+
+    def client_loop():
+        state = {}
+        try:
+            scenario.setup(state)
+        except Exception as e:
+            with lock:
+                errors.append(f'setup: {e}')
+            return
+        while True:
+            is_warmup = take()
+            if is_warmup is None:
+                return
+            try:
+                ok, latency, ttft = scenario.run_one(state)
+            except Exception as e:
+                ok, latency, ttft = False, None, None
+                error = f'{type(e).__name__}: {e}'
+            else:
+                error = None if ok else 'bad response'
+            if is_warmup:
+                continue
+            with lock:
+                if ok:
+                    latencies.append(latency)
+                    if ttft is not None:
+                        ttfts.append(ttft)
+                else:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'requests': len(latencies) + len(errors),
+        'ok': len(latencies),
+        'errors': len(errors),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'latency': percentiles(latencies),
+        'ttft': percentiles(ttfts),
+    }
+    if errors:
+        result['sample_errors'] = sorted(set(errors))[:5]
+    return result
+
+
+def print_results(results, previous=None):
+    print(f"\n{'scenario':<10} {'ok':>6} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft p50':>9} {'ttft p95':>9}")
+    for name, result in results.items():
+        latency = result['latency'] or {}
+        ttft = result['ttft'] or {}
+        print(f"{name:<10} {result['ok']:>6} {result['errors']:>5} {result['throughput_rps']:>9} "
+              f"{latency.get('p50_ms', '-'):>9} {latency.get('p95_ms', '-'):>9} {latency.get('p99_ms', '-'):>9} "
+              f"{ttft.get('p50_ms', '-'):>9} {ttft.get('p95_ms', '-'):>9}")
+        if result.get('sample_errors'):
+            print(f"{'':<10} ⚠️ {result['sample_errors']}")
+        old = (previous or {}).get(name)
+        if old:
+            def delta(new_value, old_value):
+                if not new_value or not old_value:
+                    return '-'
+                return f"{(new_value - old_value) / old_value * 100:+.1f}%"
+            print(f"{'':<10} vs previous: rps {delta(result['throughput_rps'], old['throughput_rps'])}, "
+                  f"p95 {delta(latency.get('p95_ms'), (old['latency'] or {}).get('p95_ms'))}, "
+                  f"p99 {delta(latency.get('p99_ms'), (old['latency'] or {}).get('p99_ms'))}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline load test for the food detection & recipe API')
+    parser.add_argument('--server', choices=['asgi', 'flask', 'none'], default='asgi',
+                        help="Server để chạy API; 'none' = dùng server có sẵn tại --url")
+    parser.add_argument('--url', default=None, help='URL của API (mặc định http://127.0.0.1:<--port>)')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Các kịch bản, trong {SCENARIOS}")
+    parser.add_argument('--concurrency', type=int, default=8, help='Số client song song')
+    parser.add_argument('--requests', type=int, default=100, help='Số request đo mỗi kịch bản')
+    parser.add_argument('--warmup', type=int, default=5, help='Số request warm-up (không tính) mỗi kịch bản')
+    parser.add_argument('--yolo', choices=['stub', 'real'], default='stub', help='YOLO giả hoặc models/best.pt')
+    parser.add_argument('--images', type=int, default=32, help='Số ảnh khác nhau dùng cho /detect')
+    parser.add_argument('--image-width', type=int, default=1280)
+    parser.add_argument('--image-height', type=int, default=960)
+    parser.add_argument('--stream', action='store_true', help='Kịch bản recipe dùng /generate-recipe-stream')
+    parser.add_argument('--recipe-keys', type=int, default=0,
+                        help='Số tập nguyên liệu lặp lại cho recipe (0 = mỗi request một tập, không trúng cache)')
+    parser.add_argument('--llm-port', type=int, default=1234)
+    parser.add_argument('--llm-external', action='store_true', help='Dùng LM Studio thật/đang chạy thay vì server giả')
+    parser.add_argument('--llm-latency-ms', type=float, default=200)
+    parser.add_argument('--llm-token-rate', type=float, default=50)
+    parser.add_argument('--llm-tokens', type=int, default=120)
+    parser.add_argument('--llm-slots', type=int, default=4)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Biến môi trường cho API (vd. --env DETECT_WORKERS=4), lặp lại được')
+    parser.add_argument('--output', default=None, help='File JSON kết quả (mặc định benchmarks/results/load-<thời gian>.json)')
+    parser.add_argument('--compare', default=None, help='File JSON của lần chạy trước để so sánh')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"❌ Unknown scenarios: {sorted(unknown)}")
+        return 1
+    env_overrides = dict(item.split('=', 1) for item in args.env)
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    llm_url = f"http://127.0.0.1:{args.llm_port}/v1"
+
+    llm_server = None
+    if not args.llm_external:
+        llm_server = fake_lm_studio.start(port=args.llm_port, latency_ms=args.llm_latency_ms,
+                                          token_rate=args.llm_token_rate, tokens=args.llm_tokens,
+                                          slots=args.llm_slots)
+        print(f"🤖 Fake LM Studio: {llm_url} (latency={args.llm_latency_ms}ms, {args.llm_token_rate} tok/s, "
+              f"{args.llm_tokens} tokens, slots={args.llm_slots})")
+
+    process = None
+    if args.server != 'none':
+        print(f"🚀 Starting API ({args.server}, yolo={args.yolo}) on {base_url}...")
+        process = start_app(args.server, args.port, llm_url, args.yolo, env_overrides)
+    try:
+        wait_ready(base_url, process)
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+        results = {}
+        with httpx.Client(base_url=base_url, timeout=120, limits=limits) as client:
+            for name in scenarios:
+                print(f"⏱️  {name}: {args.requests} requests, concurrency {args.concurrency}...")
+                scenario = SCENARIO_CLASSES[name](name, client, args)
+                results[name] = run_scenario(scenario, args.concurrency, args.requests, args.warmup)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if llm_server is not None:
+            llm_server.shutdown()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Results saved to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+YOLO giả cho benchmark chạy offline (benchmarks/load_test.py đặt thư mục stubs lên PYTHONPATH).
+
+Không cần file model hay torch: mỗi lần gọi ngủ BENCH_YOLO_LATENCY_MS (+ BENCH_YOLO_PER_IMAGE_MS
+cho mỗi ảnh trong batch) rồi trả về vài box ngẫu nhiên với cùng interface mà main.py dùng
+(result.boxes.cls/.conf -> .cpu().numpy()).
+"""
+import os
+import time
+
+import numpy as np
+
+LATENCY_MS = float(os.environ.get('BENCH_YOLO_LATENCY_MS', 20))
+PER_IMAGE_MS = float(os.environ.get('BENCH_YOLO_PER_IMAGE_MS', 5))
+BOXES = int(os.environ.get('BENCH_YOLO_BOXES', 8))
+
+NAMES = [
+    "carrot", "chicken", "tomato", "ginger", "beans", "banana", "sponge_gourd", "onion", "garlic",
+    "bell_pepper", "egg", "avocado", "beet", "apple", "lemon", "broccoli", "bitter_gourd", "chillies",
+    "fish", "corn", "okra", "eggplant", "beef", "cucumber", "potato", "cabbage", "cauliflower", "cheese",
+    "shrimp", "kimchi", "lettuce", "mushroom", "sausage", "coriander", "pineapple", "lime", "papaya",
+    "pork", "dragon_fruit", "pumpkin", "pear", "guava", "calabash", "watermelon", "turmeric"
+]
+
+
+class _Tensor:
+    def __init__(self, values):
+        self.values = values
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+    def __len__(self):
+        return len(self.values)
+
+
+class _Boxes:
+    def __init__(self, class_ids, confidences):
+        self.cls = _Tensor(class_ids)
+        self.conf = _Tensor(confidences)
+
+    def __len__(self):
+        return len(self.cls)
+
+
+class _Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class YOLO:
+    def __init__(self, model=None, task=None):
+        self.model_path = model
+        self.names = dict(enumerate(NAMES))
+        self.rng = np.random.default_rng(0)
+
+    def __call__(self, source, conf=0.25, **kwargs):
+        sources = source if isinstance(source, list) else [source]
+        time.sleep((LATENCY_MS + PER_IMAGE_MS * len(sources)) / 1000.0)
+        return [
+            _Result(_Boxes(
+                self.rng.integers(0, len(NAMES), BOXES).astype(np.float32),
+                self.rng.uniform(conf, 1.0, BOXES).astype(np.float32)
+            ))
+            for _ in sources
+        ]
+
+    predict = __call__
+
+    def export(self, **kwargs):
+        return self.model_path
@@ -0,0 +1,231 @@
+"""
+Lưu lịch sử chat bền vững trên SQLite (WAL) để session không mất khi restart/deploy.
+
+Request chỉ đưa thao tác ghi vào hàng đợi (không chờ đĩa). Một thread writer gom các
+thao tác đến trong khoảng commit_interval_ms (tối đa max_batch thao tác) rồi commit
+một transaction cho cả nhóm (group commit), nên chat-stream không bao giờ chờ fsync.
+Thread writer chỉ khởi động ở thao tác ghi đầu tiên (process chỉ import module, vd. process
+cha của reloader, không có thread writer).
+Đọc (khôi phục session sau restart) dùng connection riêng, WAL cho phép đọc song song
+với writer. compact() xóa session hết hạn và thu gọn file WAL.
+"""
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger('food-app.chat-journal')
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS sessions ('
+    ' session_id TEXT PRIMARY KEY, ingredients TEXT NOT NULL, recipe TEXT NOT NULL,'
+    ' created_at REAL NOT NULL, last_activity REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS sessions_last_activity ON sessions (last_activity)',
+    'CREATE TABLE IF NOT EXISTS messages ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,'
+    ' question TEXT NOT NULL, answer TEXT NOT NULL, timestamp REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)',
+)
+
+
+def _connect(path):
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')  # WAL + NORMAL: fsync khi checkpoint, không phải mỗi commit
+    return db
+
+
+class ChatJournal:
+    def __init__(self, path, commit_interval_ms=50, max_batch=256):
+        self.path = path
+        self.commit_interval = commit_interval_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.writer_db = _connect(path)
+        for statement in SCHEMA:
+            self.writer_db.execute(statement)
+        self.writer_db.commit()
+        self.reader_db = _connect(path)
+        self.reader_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.commits = 0
+        self.writes = 0
+        self.failed = 0
+        self.restored = 0
+        self.compacted = 0
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _ensure_writer(self):
+        if self.thread is None:
+            with self.thread_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='chat-journal', daemon=True)
+                    self.thread.start()
+
+    # Ghi (không chặn): chỉ đưa vào hàng đợi
+
+    def _write(self, sql, params):
+        self._ensure_writer()
+        self.queue.put(('write', sql, params))
+
+    def create(self, session):
+        self._write(
+            'INSERT OR REPLACE INTO sessions (session_id, ingredients, recipe, created_at, last_activity) VALUES (?, ?, ?, ?, ?)',
+            (session['session_id'], json.dumps(session['ingredients'], ensure_ascii=False), session['recipe'],
+             session['created_at'].timestamp(), session['last_activity'].timestamp())
+        )
+
+    def append(self, session_id, message, last_activity=None):
+        """message là ChatMessage; last_activity (epoch) nếu lượt này cũng gia hạn session"""
+        self._write(
+            'INSERT INTO messages (session_id, question, answer, timestamp) VALUES (?, ?, ?, ?)',
+            (session_id, message.question, message.answer, message.timestamp)
+        )
+        if last_activity is not None:
+            self.touch(session_id, last_activity)
+
+    def touch(self, session_id, last_activity):
+        self._write('UPDATE sessions SET last_activity = ? WHERE session_id = ?', (last_activity, session_id))
+
+    def delete(self, session_id):
+        self._write('DELETE FROM messages WHERE session_id = ?', (session_id,))
+        self._write('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    # Thao tác cần chờ writer
+
+    def _submit(self, kind, *args):
+        future = Future()
+        self._ensure_writer()
+        self.queue.put((kind, future) + args)
+        return future
+
+    def flush(self, timeout=None):
+        """Chờ các thao tác đã đưa vào hàng đợi được commit"""
+        self._submit('flush').result(timeout)
+
+    def compact(self, cutoff):
+        """Xóa session có last_activity trước cutoff (epoch) cùng các lượt chat, trả về số session bị xóa"""
+        return self._submit('compact', cutoff).result()
+
+    # Đọc
+
+    def load(self, session_id, limit, since=None):
+        """
+        Khôi phục session: (meta, limit lượt gần nhất, tổng số lượt) hoặc None nếu không có
+        (hoặc last_activity trước since).
+        """
+        self.flush()
+        with self.reader_lock:
+            meta = self.reader_db.execute(
+                'SELECT ingredients, recipe, created_at, last_activity FROM sessions WHERE session_id = ?',
+                (session_id,)
+            ).fetchone()
+            if meta is None or (since is not None and meta[3] < since):
+                return None
+            total = self.reader_db.execute(
+                'SELECT COUNT(*) FROM messages WHERE session_id = ?', (session_id,)
+            ).fetchone()[0]
+            rows = self.reader_db.execute(
+                'SELECT question, answer, timestamp FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?',
+                (session_id, limit)
+            ).fetchall()
+        with self.stats_lock:
+            self.restored += 1
+        session = {
+            'session_id': session_id,
+            'ingredients': json.loads(meta[0]),
+            'recipe': meta[1],
+            'created_at': meta[2],
+            'last_activity': meta[3]
+        }
+        return session, rows[::-1], total
+
+    def messages(self, session_id):
+        """Toàn bộ lượt chat của session (cũ -> mới) dạng (question, answer, timestamp)"""
+        self.flush()
+        with self.reader_lock:
+            return self.reader_db.execute(
+                'SELECT question, answer, timestamp FROM messages WHERE session_id = ? ORDER BY id',
+                (session_id,)
+            ).fetchall()
+
+    # Writer thread
+
+    def _collect_batch(self):
+        # Chờ thao tác đầu tiên, sau đó gom thêm trong commit_interval để commit một lần
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.commit_interval
+        while len(batch) < self.max_batch and batch[-1][0] == 'write':
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            writes = [op for op in batch if op[0] == 'write']
+            if writes:
+                try:
+                    with self.writer_db:
+                        for _, sql, params in writes:
+                            self.writer_db.execute(sql, params)
+                    with self.stats_lock:
+                        self.commits += 1
+                        self.writes += len(writes)
+                except sqlite3.Error as e:
+                    logger.error("❌ Chat journal commit failed (%d writes dropped): %s", len(writes), e)
+                    with self.stats_lock:
+                        self.failed += len(writes)
+            # Batch chỉ kết thúc bằng flush/compact/close (các thao tác ghi trước đó đã commit ở trên)
+            kind = batch[-1][0]
+            if kind == 'flush':
+                batch[-1][1].set_result(None)
+            elif kind == 'compact':
+                self._compact(*batch[-1][1:])
+            elif kind == 'close':
+                batch[-1][1].set_result(None)
+                return
+
+    def _compact(self, future, cutoff):
+        try:
+            with self.writer_db:
+                self.writer_db.execute(
+                    'DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE last_activity < ?)',
+                    (cutoff,)
+                )
+                removed = self.writer_db.execute('DELETE FROM sessions WHERE last_activity < ?', (cutoff,)).rowcount
+            # Gộp WAL vào file chính và cắt WAL về 0 để file không lớn dần
+            self.writer_db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            with self.stats_lock:
+                self.compacted += removed
+            future.set_result(removed)
+        except sqlite3.Error as e:
+            future.set_exception(e)
+
+    def close(self):
+        """Commit nốt hàng đợi và dừng writer (gọi khi tắt process)"""
+        if self.thread is not None and self.thread.is_alive():
+            self._submit('close').result(5)
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'path': self.path,
+                'pending': self.queue.qsize(),
+                'commits': self.commits,
+                'writes': self.writes,
+                'failed': self.failed,
+                'restored_sessions': self.restored,
+                'compacted_sessions': self.compacted
+            }
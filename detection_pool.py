@@ -0,0 +1,255 @@
+"""
+Pool các process chạy YOLO cho /detect và /detect-batch.
+
+Mỗi worker là một process Python riêng với model của riêng nó và số thread
+torch/OpenMP cố định, nên N worker chạy song song trên N nhóm core mà không
+tranh nhau GIL hay thread pool của một model dùng chung. Ảnh được ghi vào
+shared memory (mỗi worker một vùng cố định), qua pipe chỉ gửi tên vùng nhớ,
+shape và dtype.
+
+Worker được chạy bằng `python detection_pool.py ...` nên không import lại main.py
+(không load Flask, session store, cache...).
+"""
+import argparse
+import atexit
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+class _Worker:
+    """Một process worker cùng vùng shared memory cố định của nó"""
+
+    def __init__(self, index, command, env, slot_bytes):
+        self.index = index
+        self.command = command
+        self.env = env
+        self.slot = shared_memory.SharedMemory(create=True, size=slot_bytes)
+        self.process = None
+        self.names = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command + ['--slot', self.slot.name],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=self.env
+        )
+
+    def wait_ready(self):
+        """Chờ worker load model và warm-up xong"""
+        reply = pickle.load(self.process.stdout)
+        if reply[0] != 'ready':
+            raise RuntimeError(f"Detection worker {self.index} failed to start: {reply[1]}")
+        self.names = reply[1]
+
+    def detect(self, image, conf):
+        image = np.ascontiguousarray(image)
+        # Ảnh lớn hơn vùng cố định: tạo vùng tạm, xóa sau khi worker trả lời
+        shm = self.slot
+        if image.nbytes > self.slot.size:
+            shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+        try:
+            view = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+            view[...] = image
+            del view
+            pickle.dump((shm.name, image.shape, image.dtype.str, conf), self.process.stdin)
+            self.process.stdin.flush()
+            reply = pickle.load(self.process.stdout)
+        finally:
+            if shm is not self.slot:
+                shm.close()
+                shm.unlink()
+        if reply[0] == 'error':
+            raise RuntimeError(reply[1])
+        return reply[1], reply[2]
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def close(self):
+        self.stop()
+        self.slot.close()
+        self.slot.unlink()
+
+
+class DetectionWorkerPool:
+    """
+    N process YOLO, mỗi request được giao cho một worker đang rảnh.
+    submit() trả về Future chứa detections [(class_ids, confidences)] giống InferenceScheduler.
+    """
+
+    def __init__(self, model_path, workers=2, threads=1, imgsz=640, slot_mb=8, warmup_runs=2,
+                 pin_cpus=False):
+        self.size = max(1, workers)
+        self.threads = max(1, threads)
+        cpus = sorted(os.sched_getaffinity(0)) if pin_cpus and hasattr(os, 'sched_getaffinity') else None
+        self.workers = []
+        for index in range(self.size):
+            command = [sys.executable, os.path.abspath(__file__),
+                       '--model', str(model_path),
+                       '--threads', str(self.threads),
+                       '--imgsz', str(imgsz),
+                       '--warmup', str(warmup_runs)]
+            if cpus:
+                start = index * self.threads
+                worker_cpus = [cpus[(start + i) % len(cpus)] for i in range(self.threads)]
+                command += ['--cpus', ','.join(map(str, worker_cpus))]
+            env = dict(os.environ, **{name: str(self.threads) for name in THREAD_ENV_VARS})
+            self.workers.append(_Worker(index, command, env, int(slot_mb * 1024 * 1024)))
+        atexit.register(self.close)
+        # Các worker load model song song
+        for worker in self.workers:
+            worker.start()
+        for worker in self.workers:
+            worker.wait_ready()
+        self.names = self.workers[0].names
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.restarts = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='detect-pool')
+
+    def submit(self, image, conf):
+        """Giao ảnh cho worker rảnh, trả về Future với detections của ảnh"""
+        return self.executor.submit(self._detect, image, conf)
+
+    def _detect(self, image, conf):
+        worker = self.idle.get()
+        try:
+            return [worker.detect(image, conf)]
+        except (EOFError, OSError, pickle.UnpicklingError) as e:
+            # Worker chết giữa chừng: khởi động lại rồi báo lỗi cho request này
+            self._restart(worker)
+            raise RuntimeError(f"Detection worker {worker.index} crashed: {e}") from e
+        finally:
+            self.idle.put(worker)
+
+    def _restart(self, worker):
+        worker.stop()
+        worker.start()
+        worker.wait_ready()
+        with self.lock:
+            self.restarts += 1
+
+    def stats(self):
+        return {
+            'workers': self.size,
+            'threads_per_worker': self.threads,
+            'idle': self.idle.qsize(),
+            'restarts': self.restarts
+        }
+
+    def close(self):
+        executor = getattr(self, 'executor', None)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for worker in self.workers:
+            try:
+                worker.close()
+            except Exception:
+                pass
+        self.workers = []
+
+
+# ==================== WORKER PROCESS ====================
+
+def _attach(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # Vùng nhớ do process cha quản lý, tránh resource tracker của worker xóa nó khi thoát
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _extract(result):
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return boxes.cls.cpu().numpy().astype(np.int64), boxes.conf.cpu().numpy().astype(np.float64)
+
+
+def _detect(model, shm, shape, dtype, conf, imgsz):
+    # Không để view trên shared memory sống sót sau khi trả về (kể cả qua traceback),
+    # nếu không shm.close() sẽ lỗi BufferError
+    try:
+        image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        results = model(image, conf=conf, imgsz=imgsz, verbose=False)
+        class_ids, confidences = _extract(results[0])
+        return 'ok', class_ids, confidences
+    except Exception as e:
+        return 'error', str(e)
+
+
+def worker_main(argv=None):
+    parser = argparse.ArgumentParser(description='YOLO detection worker')
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--slot', required=True)
+    parser.add_argument('--cpus', default='')
+    args = parser.parse_args(argv)
+
+    # stdout dành cho giao thức với process cha, log của ultralytics chuyển sang stderr
+    replies = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    requests = sys.stdin.buffer
+
+    def reply(message):
+        pickle.dump(message, replies)
+        replies.flush()
+
+    try:
+        if args.cpus and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {int(cpu) for cpu in args.cpus.split(',')})
+        try:
+            import torch
+            torch.set_num_threads(args.threads)
+        except ImportError:
+            pass
+        from ultralytics import YOLO
+        model = YOLO(args.model, task='detect')
+        dummy = np.zeros((args.imgsz, args.imgsz, 3), dtype=np.uint8)
+        for _ in range(args.warmup):
+            model(dummy, imgsz=args.imgsz, verbose=False)
+        slot = _attach(args.slot)
+    except Exception as e:
+        reply(('error', str(e)))
+        return 1
+    reply(('ready', dict(model.names)))
+
+    while True:
+        try:
+            name, shape, dtype, conf = pickle.load(requests)
+        except EOFError:
+            break
+        if name == slot.name:
+            reply(_detect(model, slot, shape, dtype, conf, args.imgsz))
+            continue
+        try:
+            shm = _attach(name)
+        except Exception as e:
+            reply(('error', str(e)))
+            continue
+        message = _detect(model, shm, shape, dtype, conf, args.imgsz)
+        shm.close()
+        reply(message)
+    slot.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(worker_main())
@@ -0,0 +1,171 @@
+"""
+Giới hạn số generation chạy đồng thời trên LM Studio.
+
+Tối đa max_in_flight request được gọi LM Studio cùng lúc, phần còn lại xếp hàng
+(tối đa max_queue) theo độ ưu tiên: chat (người dùng đang chờ) được phục vụ trước
+tạo công thức. Hàng đợi đầy thì từ chối ngay với 429, chờ quá queue_timeout thì 503,
+thay vì để tất cả request cùng chậm khi LM Studio quá tải.
+
+Dùng chung cho thread (Flask, acquire) và asyncio (asgi.py, acquire_async).
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+# Số nhỏ hơn = ưu tiên cao hơn
+PRIORITIES = {'chat': 0, 'recipe': 1}
+
+
+class LLMBusyError(Exception):
+    """LM Studio đang quá tải: status 429 (hàng đợi đầy) hoặc 503 (chờ quá lâu)"""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('notify', 'granted', 'cancelled')
+
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+
+
+class Permit:
+    """Một slot đang chạy trên LM Studio; release() gọi nhiều lần cũng chỉ trả slot một lần"""
+
+    def __init__(self, gateway, wait_seconds):
+        self.gateway = gateway
+        self.wait_seconds = wait_seconds
+        self.released = False
+
+    def release(self):
+        self.gateway._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class LLMGateway:
+    def __init__(self, max_in_flight=4, max_queue=32, queue_timeout=10.0, on_admit=None):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.retry_after = max(1, int(queue_timeout))
+        self.on_admit = on_admit  # callback(wait_seconds) khi request được chạy
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.waiters = []  # heap (priority, seq, waiter), có thể còn waiter đã hủy
+        self.sequence = itertools.count()
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'timeout': 0}
+
+    def _enter(self, kind, notify):
+        """Vào chạy ngay (trả về None) hoặc xếp hàng (trả về waiter)"""
+        priority = PRIORITIES.get(kind, len(PRIORITIES))
+        with self.lock:
+            if self.in_flight < self.max_in_flight and self.queued == 0:
+                self.in_flight += 1
+                return None
+            if self.queued >= self.max_queue:
+                self.rejected['queue_full'] += 1
+                raise LLMBusyError('LM Studio đang quá tải, vui lòng thử lại sau', 429, self.retry_after)
+            if len(self.waiters) > 4 * self.max_queue + 64:
+                # Dọn các waiter đã hủy (hết thời gian chờ) còn nằm trong heap
+                self.waiters = [item for item in self.waiters if not item[2].cancelled]
+                heapq.heapify(self.waiters)
+            waiter = _Waiter(notify)
+            heapq.heappush(self.waiters, (priority, next(self.sequence), waiter))
+            self.queued += 1
+            return waiter
+
+    def _cancel(self, waiter, reason=None):
+        """Bỏ chờ; trả về True nếu slot đã được giao cho waiter trước đó"""
+        with self.lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self.queued -= 1
+            if reason:
+                self.rejected[reason] += 1
+            return False
+
+    def _admit(self, started):
+        wait_seconds = time.perf_counter() - started
+        with self.lock:
+            self.admitted += 1
+        if self.on_admit:
+            self.on_admit(wait_seconds)
+        return Permit(self, wait_seconds)
+
+    def _release(self, permit):
+        with self.lock:
+            if permit.released:
+                return
+            permit.released = True
+            # Giao slot thẳng cho waiter ưu tiên cao nhất, in_flight giữ nguyên
+            while self.waiters:
+                _, _, waiter = heapq.heappop(self.waiters)
+                if not waiter.cancelled:
+                    waiter.granted = True
+                    self.queued -= 1
+                    waiter.notify()
+                    return
+            self.in_flight -= 1
+
+    def _timeout_error(self):
+        return LLMBusyError('Hết thời gian chờ LM Studio, vui lòng thử lại sau', 503, self.retry_after)
+
+    def acquire(self, kind):
+        """Chờ tới lượt (blocking), trả về Permit hoặc raise LLMBusyError"""
+        started = time.perf_counter()
+        event = threading.Event()
+        waiter = self._enter(kind, event.set)
+        if waiter is not None and not event.wait(self.queue_timeout):
+            if not self._cancel(waiter, 'timeout'):
+                raise self._timeout_error()
+        return self._admit(started)
+
+    async def acquire_async(self, kind):
+        """Giống acquire() nhưng chờ trên event loop"""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            # Có thể được gọi từ thread khác (request Flask trả slot)
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = self._enter(kind, notify)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not self._cancel(waiter, 'timeout'):
+                    raise self._timeout_error()
+            except asyncio.CancelledError:
+                # Client ngắt kết nối khi đang chờ: trả lại slot nếu vừa được giao
+                if self._cancel(waiter):
+                    self._release(Permit(self, 0.0))
+                raise
+        return self._admit(started)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected)
+            }
@@ -1,115 +1,671 @@
-from flask import Flask, request, jsonify, Response
+import time
+STARTUP_STARTED = time.perf_counter()  # Mốc đo thời gian khởi động
+
+from flask import Flask, request, jsonify, Response, g
 from flask_cors import CORS
-from ultralytics import YOLO
-import tempfile
+from PIL import Image, ImageOps
+from pathlib import Path
+import numpy as np
+import io
 import os
 import json
 import traceback
 from openai import OpenAI
+import httpx
 import uuid
 from datetime import datetime, timedelta
 import threading
-import time
+import queue
+import hashlib
+import hmac
+import sqlite3
+import unicodedata
+import re
+import logging
+import random
+from collections import OrderedDict
+from types import MappingProxyType
+from concurrent.futures import Future
 from flask import stream_with_context
+from session_store import create_session_store
+from metrics import REGISTRY
+from detection_pool import DetectionWorkerPool
+from llm_gateway import LLMGateway, LLMBusyError
+from single_flight import SingleFlight
+import sse
 
 # Tạo Flask app
 app = Flask(__name__)
 CORS(app)
 
+# Logging: lỗi/cảnh báo luôn được ghi, log theo request (INFO/DEBUG) chỉ ghi theo tỉ lệ LOG_SAMPLE_RATE
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
+
+class SampledFilter(logging.Filter):
+    """Chỉ giữ một phần log dưới mức WARNING để không tốn thời gian trên hot path"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('food-app')
+request_logger = logging.getLogger('food-app.request')
+request_logger.addFilter(SampledFilter(LOG_SAMPLE_RATE))
+
+# Metrics (/metrics)
+stage_seconds = REGISTRY.histogram('food_app_stage_seconds', 'Latency by processing stage', ['stage'])
+requests_total = REGISTRY.counter('food_app_requests_total', 'Requests by route', ['route', 'method', 'status'])
+request_seconds = REGISTRY.histogram('food_app_request_seconds', 'Time until response headers by route', ['route'])
+
 # Config
 YOLO_MODEL_PATH = './models/best.pt'  # Đường dẫn đến model YOLO đã train
+CLASS_TRANSLATIONS_PATH = os.environ.get(
+    'CLASS_TRANSLATIONS_PATH', str(Path(__file__).parent / 'data' / 'translations.json')
+)  # Bảng dịch tên class sang tiếng Việt
 model = "google/gemma-3-1b"  # Model LM Studio sử dụng
+LM_STUDIO_URL = os.environ.get('LM_STUDIO_URL', "http://localhost:1234/v1")
+LLM_MAX_IN_FLIGHT = int(os.environ.get('LLM_MAX_IN_FLIGHT', 4))  # Số generation chạy cùng lúc trên LM Studio
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', 32))  # Số request chờ tối đa, vượt quá trả về 429
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 10))  # Thời gian chờ tối đa trong hàng đợi (giây), quá thì 503
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 120))  # Timeout mỗi request tới LM Studio (giây)
+# Connection pool giữ sẵn kết nối keep-alive cho các slot đang chạy (+2 cho health probe)
+LLM_POOL_LIMITS = httpx.Limits(
+    max_connections=LLM_MAX_IN_FLIGHT + 2,
+    max_keepalive_connections=LLM_MAX_IN_FLIGHT + 2,
+    keepalive_expiry=60
+)
 client = OpenAI(
-    base_url="http://localhost:1234/v1",
-    api_key="lm-studio"  # Chỉ là chuỗi giả
+    base_url=LM_STUDIO_URL,
+    api_key="lm-studio",  # Chỉ là chuỗi giả
+    timeout=LLM_TIMEOUT,
+    http_client=httpx.Client(limits=LLM_POOL_LIMITS)
+)
+YOLO_BACKEND = os.environ.get('YOLO_BACKEND', 'pytorch')  # 'pytorch', 'onnx' hoặc 'openvino'
+YOLO_IMGSZ = int(os.environ.get('YOLO_IMGSZ', 640))  # Kích thước ảnh đầu vào của model
+YOLO_DYNAMIC = os.environ.get('YOLO_DYNAMIC', '1') == '1'  # Export với input động (batch/kích thước thay đổi)
+YOLO_HALF = os.environ.get('YOLO_HALF', '0') == '1'  # Export FP16
+YOLO_INT8 = os.environ.get('YOLO_INT8', '0') == '1'  # Export INT8 (OpenVINO, cần dữ liệu calibration)
+YOLO_INT8_DATA = os.environ.get('YOLO_INT8_DATA', '')  # File dataset yaml của model để calibration INT8 (bắt buộc khi YOLO_INT8=1)
+YOLO_WARMUP_RUNS = int(os.environ.get('YOLO_WARMUP_RUNS', 2))  # Số lần chạy ảnh giả khi khởi động
+YOLO_LOADING_RETRY_AFTER = int(os.environ.get('YOLO_LOADING_RETRY_AFTER', 5))  # Retry-After (giây) khi model đang load
+DETECT_CONF = 0.3  # Ngưỡng confidence cho YOLO
+DETECT_BATCH_SIZE = int(os.environ.get('DETECT_BATCH_SIZE', 8))  # Số ảnh tối đa trong một batch
+DETECT_BATCH_MAX_WAIT_MS = float(os.environ.get('DETECT_BATCH_MAX_WAIT_MS', 10))  # Thời gian chờ tối đa để gom batch
+DETECT_MAX_BATCH_IMAGES = int(os.environ.get('DETECT_MAX_BATCH_IMAGES', 16))  # Số ảnh tối đa mỗi request /detect-batch
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', 20))  # Dung lượng tối đa của body upload (MB)
+DETECT_MAX_IMAGE_PIXELS = int(os.environ.get('DETECT_MAX_IMAGE_PIXELS', 50_000_000))  # Số pixel tối đa của ảnh upload
+DETECT_WORKERS = int(os.environ.get('DETECT_WORKERS', 0))  # Số process YOLO (0 = chạy trong process này với batching)
+DETECT_WORKER_THREADS = int(os.environ.get('DETECT_WORKER_THREADS', 1))  # Số thread torch/OpenMP mỗi worker
+DETECT_WORKER_SLOT_MB = float(os.environ.get('DETECT_WORKER_SLOT_MB', 8))  # Shared memory cố định mỗi worker
+DETECT_WORKER_PIN_CPUS = os.environ.get('DETECT_WORKER_PIN_CPUS', '0') == '1'  # Gắn mỗi worker vào nhóm CPU riêng
+DETECT_STREAM_DIFF_THRESHOLD = float(os.environ.get('DETECT_STREAM_DIFF_THRESHOLD', 0.03))  # Độ khác tối thiểu (0-1) giữa hai frame để detect lại
+DETECT_STREAM_EMA_ALPHA = float(os.environ.get('DETECT_STREAM_EMA_ALPHA', 0.5))  # Trọng số của frame mới khi cộng dồn confidence
+DETECT_STREAM_ENTER_SCORE = float(os.environ.get('DETECT_STREAM_ENTER_SCORE', 0.25))  # Điểm cộng dồn để thêm nguyên liệu
+DETECT_STREAM_LEAVE_SCORE = float(os.environ.get('DETECT_STREAM_LEAVE_SCORE', 0.1))  # Điểm cộng dồn để bỏ nguyên liệu
+DETECT_CACHE_SIZE = int(os.environ.get('DETECT_CACHE_SIZE', 512))  # Số kết quả detect tối đa được cache
+DETECT_CACHE_TTL = float(os.environ.get('DETECT_CACHE_TTL', 3600))  # Thời gian sống của cache (giây)
+RECIPE_CACHE_SIZE = int(os.environ.get('RECIPE_CACHE_SIZE', 256))  # Số công thức tối đa được cache trong RAM
+RECIPE_CACHE_TTL = float(os.environ.get('RECIPE_CACHE_TTL', 86400))  # Thời gian sống của công thức cache (giây)
+RECIPE_CACHE_DB = os.environ.get('RECIPE_CACHE_DB', '')  # File SQLite để lưu cache qua các lần restart (rỗng = tắt)
+
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 1200))  # Giới hạn token của prompt chat
+CHAT_TURN_SUMMARY_CHARS = int(os.environ.get('CHAT_TURN_SUMMARY_CHARS', 200))  # Độ dài câu trả lời cũ khi bị rút gọn
+SSE_FLUSH_INTERVAL_MS = float(os.environ.get('SSE_FLUSH_INTERVAL_MS', 30))  # Cửa sổ gom token thành một frame SSE (0 = mỗi token một frame)
+SSE_FLUSH_MAX_CHARS = int(os.environ.get('SSE_FLUSH_MAX_CHARS', 512))  # Gửi frame ngay khi phần đang gom đạt số ký tự này
+LM_STUDIO_PROBE_INTERVAL = float(os.environ.get('LM_STUDIO_PROBE_INTERVAL', 15))  # Chu kỳ kiểm tra LM Studio (giây)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')  # 'memory' hoặc 'redis'
+SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+SESSION_SHARDS = int(os.environ.get('SESSION_SHARDS', 16))  # Số shard (lock) của memory store
+SESSION_HISTORY_SIZE = int(os.environ.get('SESSION_HISTORY_SIZE', 20))  # Số lượt hỏi đáp giữ trong RAM mỗi session
+SESSION_ARCHIVE_DIR = os.environ.get('SESSION_ARCHIVE_DIR', '')  # Thư mục lưu lượt cũ cho /get-chat-history (rỗng = bỏ)
+SESSION_JOURNAL_PATH = os.environ.get('SESSION_JOURNAL_PATH', '')  # File SQLite lưu session/lịch sử chat qua restart (rỗng = chỉ RAM)
+SESSION_JOURNAL_COMMIT_MS = float(os.environ.get('SESSION_JOURNAL_COMMIT_MS', 50))  # Cửa sổ gom ghi thành một commit
+SESSION_JOURNAL_BATCH = int(os.environ.get('SESSION_JOURNAL_BATCH', 256))  # Số thao tác tối đa mỗi commit
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')  # Token cho /admin/* (header Authorization: Bearer <token>), rỗng = tắt
+SESSION_TTL = timedelta(hours=2)  # Session hết hạn sau 2 giờ không hoạt động
+SESSION_CLEANUP_INTERVAL = float(os.environ.get('SESSION_CLEANUP_INTERVAL', 300))  # Chu kỳ dọn session (giây)
+
+# Hàng đợi có ưu tiên cho các endpoint gọi LM Studio (chat trước, công thức sau)
+llm_gateway = LLMGateway(
+    max_in_flight=LLM_MAX_IN_FLIGHT,
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+    on_admit=lambda wait_seconds: stage_seconds.observe(wait_seconds, 'llm_queue_wait')
 )
 
-# Session storage (trong production nên dùng Redis)
-chat_sessions = {}
-session_lock = threading.Lock()
+# Payload/sự kiện của các endpoint gọi LM Studio dùng chung cho Flask (main.py) và asgi.py:
+# hai server chỉ khác phần vận chuyển (gọi trực tiếp hay await/run_in_threadpool)
+
+LLM_TROUBLESHOOTING = [
+    'Kiểm tra LM Studio có đang chạy không (localhost:1234)',
+    'Kiểm tra model đã được load chưa',
+    'Kiểm tra kết nối mạng',
+    'Xem lại cấu hình API endpoint'
+]
+
+def busy_payload(busy):
+    """Body của response 429/503 khi LM Studio quá tải (kèm header Retry-After: busy.retry_after)"""
+    return {
+        'error': str(busy),
+        'success': False,
+        'type': 'error',
+        'retry_after': busy.retry_after
+    }
+
+def llm_busy_response(busy):
+    """Response 429/503 khi LM Studio quá tải"""
+    response = jsonify(busy_payload(busy))
+    response.status_code = busy.status
+    response.headers['Retry-After'] = str(busy.retry_after)
+    return response
+
+def server_error_payload(error):
+    return {
+        'error': f'Server error: {str(error)}',
+        'success': False
+    }
+
+def llm_error_message(api_error):
+    """Ghi log lỗi gọi LM Studio, trả về thông báo cho người dùng"""
+    logger.error("❌ LM Studio API error: %s", api_error)
+    return f'Không thể kết nối tới LM Studio API. Vui lòng kiểm tra: {str(api_error)}'
+
+def llm_error_payload(api_error):
+    """Body 503 khi không gọi được LM Studio"""
+    return {
+        'error': llm_error_message(api_error),
+        'success': False,
+        'troubleshooting': LLM_TROUBLESHOOTING
+    }
+
+def error_event(message):
+    """Sự kiện SSE báo lỗi"""
+    return sse.event({'error': message, 'type': 'error'})
+
+class LLMTimings:
+    """Đo time-to-first-token và tổng thời gian của một lời gọi LM Studio (stream) vào stage_seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first = True
+
+    def delta(self, chunk):
+        """Nội dung mới của một chunk (None nếu không có), ghi llm_ttft ở delta đầu tiên"""
+        if not (chunk.choices and chunk.choices[0].delta.content):
+            return None
+        if self.first:
+            stage_seconds.observe(time.perf_counter() - self.started, 'llm_ttft')
+            self.first = False
+        return chunk.choices[0].delta.content
+
+    def finish(self):
+        stage_seconds.observe(time.perf_counter() - self.started, 'llm_total')
+
+def frame_coalescer():
+    """TokenCoalescer theo cấu hình SSE_FLUSH_*"""
+    return sse.TokenCoalescer(SSE_FLUSH_INTERVAL_MS, SSE_FLUSH_MAX_CHARS)
+
+# Header chung của các endpoint streaming (text/event-stream)
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'X-Accel-Buffering': 'no',  # Không để nginx giữ lại các frame
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+# Flask tự từ chối body lớn hơn giới hạn (kể cả khi không có Content-Length)
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+# Session storage: memory (chia shard) hoặc redis (dùng chung giữa nhiều process)
+session_store = create_session_store(
+    SESSION_BACKEND,
+    redis_url=SESSION_REDIS_URL,
+    ttl_seconds=SESSION_TTL.total_seconds(),
+    shards=SESSION_SHARDS,
+    history_size=SESSION_HISTORY_SIZE,
+    archive_dir=SESSION_ARCHIVE_DIR,
+    journal_path=SESSION_JOURNAL_PATH,
+    journal_commit_ms=SESSION_JOURNAL_COMMIT_MS,
+    journal_batch=SESSION_JOURNAL_BATCH
+)
+session_journal = getattr(session_store, 'journal', None)
+
+# Thống kê dọn dẹp session (hiển thị trong /health)
+cleanup_stats = {
+    'cycles': 0,
+    'last_evicted': 0,
+    'total_evicted': 0,
+    'last_duration_ms': 0.0,
+    'last_run': None
+}
 
 # Session cleanup thread
 def cleanup_old_sessions():
     while True:
-        with session_lock:
-            current_time = datetime.now()
-            expired_sessions = [
-                session_id for session_id, session_data in chat_sessions.items()
-                if current_time - session_data['last_activity'] > timedelta(hours=2)
-            ]
-            for session_id in expired_sessions:
-                del chat_sessions[session_id]
-        time.sleep(300)  # Check every 5 minutes
+        started = time.perf_counter()
+        evicted = session_store.expire(datetime.now() - SESSION_TTL)
+        cleanup_stats['cycles'] += 1
+        cleanup_stats['last_evicted'] = evicted
+        cleanup_stats['total_evicted'] += evicted
+        cleanup_stats['last_duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        cleanup_stats['last_run'] = datetime.now().isoformat()
+        if evicted:
+            logger.info("🧹 Expired %d chat session(s)", evicted)
+        try:
+            purged = recipe_cache.purge()
+            if purged:
+                logger.info("🧹 Purged %d expired recipe cache row(s)", purged)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Recipe cache purge failed: {e}")
+        time.sleep(SESSION_CLEANUP_INTERVAL)
 
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_old_sessions, daemon=True)
-cleanup_thread.start()
+# Ingredient translation mapping (tên class tiếng Anh -> tiếng Việt), đọc một lần khi khởi động
+def load_translations(path=CLASS_TRANSLATIONS_PATH):
+    """Đọc bảng dịch từ file JSON {english_name: vietnamese_name}"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return MappingProxyType(json.load(f))
+    except (OSError, ValueError) as e:
+        logger.warning("⚠️ Cannot load class translations from %s: %s", path, e)
+        return MappingProxyType({})
+
+TRANSLATIONS = load_translations()
 
-# Ingredient translation mapping
 def datamap(ingredient):
     """
     Map English ingredient names to Vietnamese
     """
-    translations = {
-        "carrot": "Cà rốt",
-        "chicken": "Thịt gà",
-        "tomato": "Cà chua",
-        "ginger": "Gừng",
-        "beans": "Đậu",
-        "banana": "Chuối",
-        "sponge_gourd": "Mướp hương",
-        "onion": "Hành tây",
-        "garlic": "Tỏi",
-        "bell_pepper": "Ớt chuông",
-        "egg": "Trứng",
-        "avocado": "Bơ",
-        "beet": "Củ dền",
-        "apple": "Táo",
-        "lemon": "Chanh vàng",
-        "broccoli": "Bông cải xanh",
-        "bitter_gourd": "Khổ qua",
-        "chillies": "Ớt",
-        "fish": "Cá",
-        "corn": "Bắp",
-        "okra": "Đậu bắp",
-        "eggplant": "Cà tím",
-        "beef": "Thịt bò",
-        "cucumber": "Dưa leo",
-        "potato": "Khoai tây",
-        "cabbage": "Bắp cải",
-        "cauliflower": "Súp lơ trắng",
-        "cheese": "Phô mai",
-        "shrimp": "Tôm",
-        "kimchi": "Kim chi",
-        "lettuce": "Xà lách",
-        "mushroom": "Nấm",
-        "sausage": "Xúc xích",
-        "coriander": "Rau mùi",
-        "pineapple": "Thơm",
-        "lime": "Chanh xanh",
-        "papaya": "Đu đủ",
-        "pork": "Thịt heo",
-        "dragon_fruit": "Thanh long",
-        "pumpkin": "Bí đỏ",
-        "pear": "Lê",
-        "guava": "Ổi",
-        "calabash": "Bầu",
-        "watermelon": "Dưa hấu",
-        "turmeric": "Nghệ"
-    }
-    
-    return translations.get(ingredient, ingredient)  # Trả về tên gốc nếu không tìm thấy
+    return TRANSLATIONS.get(ingredient, ingredient)  # Trả về tên gốc nếu không tìm thấy
 
 # Load YOLO model
-print("🔄 Loading YOLO model...")
-try:
-    yolo_model = YOLO(YOLO_MODEL_PATH)
-    print(f"✅ YOLO model loaded! Classes: {list(yolo_model.names.values())}")
-    model_loaded = True
-except Exception as e:
-    print(f"❌ Failed to load YOLO model: {str(e)}")
-    yolo_model = None
-    model_loaded = False
+def exported_model_path(model_path, backend):
+    """Đường dẫn model đã export mà ultralytics tạo ra cạnh file .pt"""
+    path = Path(model_path)
+    if backend == 'onnx':
+        return path.with_suffix('.onnx')
+    if backend == 'openvino':
+        return path.parent / f"{path.stem}{'_int8' if YOLO_INT8 else ''}_openvino_model"
+    raise ValueError(f"Unknown YOLO backend: {backend}")
+
+def prepare_model_path(model_path=YOLO_MODEL_PATH, backend=YOLO_BACKEND):
+    """
+    Đường dẫn model cần load theo backend. Với onnx/openvino, export từ file .pt nếu chưa có
+    (hoặc file .pt mới hơn bản export).
+    Xóa bản export để export lại khi đổi các tùy chọn YOLO_IMGSZ/YOLO_HALF/YOLO_INT8/YOLO_DYNAMIC.
+    Export INT8 calibration trên dataset của model (YOLO_INT8_DATA); không export nếu thiếu,
+    vì ultralytics sẽ tự tải COCO và calibration sai phân phối dữ liệu.
+    """
+    if backend == 'pytorch':
+        return str(model_path)
+    target = exported_model_path(model_path, backend)
+    if not target.exists() or target.stat().st_mtime < Path(model_path).stat().st_mtime:
+        options = {}
+        if YOLO_INT8:
+            if not YOLO_INT8_DATA:
+                raise ValueError("YOLO_INT8=1 requires YOLO_INT8_DATA (dataset yaml of the model) for calibration")
+            if not Path(YOLO_INT8_DATA).exists():
+                raise FileNotFoundError(f"YOLO_INT8_DATA not found: {YOLO_INT8_DATA}")
+            options = {'int8': True, 'data': YOLO_INT8_DATA}
+        from ultralytics import YOLO  # import torch mất vài giây, chỉ làm trên thread load model
+        logger.info("📦 Exporting YOLO model to %s...", backend)
+        target = Path(YOLO(model_path).export(
+            format=backend,
+            imgsz=YOLO_IMGSZ,
+            dynamic=YOLO_DYNAMIC,
+            half=YOLO_HALF,
+            **options
+        ))
+    return str(target)
+
+def load_yolo_model(model_path=YOLO_MODEL_PATH, backend=YOLO_BACKEND):
+    """Load model theo backend (export trước nếu cần, xem prepare_model_path)"""
+    from ultralytics import YOLO  # import torch mất vài giây, chỉ làm trên thread load model
+    path = prepare_model_path(model_path, backend)
+    return YOLO(path) if backend == 'pytorch' else YOLO(path, task='detect')
+
+def warmup_yolo_model(model, runs=YOLO_WARMUP_RUNS):
+    """Chạy ảnh giả để khởi tạo runtime trước request đầu tiên"""
+    dummy = np.zeros((YOLO_IMGSZ, YOLO_IMGSZ, 3), dtype=np.uint8)
+    for _ in range(runs):
+        model(dummy, conf=DETECT_CONF, imgsz=YOLO_IMGSZ, verbose=False)
+
+# Model được load trên thread nền (load_detector) để server nhận request ngay khi khởi động;
+# trong lúc đó /detect, /detect-batch, /classes trả 503 "warming_up"
+model_state = {'status': 'loading', 'error': None}  # loading | ready | failed
+model_ready = threading.Event()  # set khi load xong (thành công hoặc lỗi)
+startup_timings = {}  # Thời gian các bước khởi động (giây)
+yolo_model = None
+model_loaded = False
+
+class ClassRegistry:
+    """
+    Thông tin các class của model, tạo một lần khi load model và không đổi khi chạy:
+    bảng tra theo class_id cho post-processing và response /classes đã serialize sẵn kèm ETag.
+    """
+
+    def __init__(self, names, translations=TRANSLATIONS):
+        size = max(names) + 1 if names else 0
+        self.known = np.zeros(size, dtype=bool)
+        self.english = np.empty(size, dtype=object)
+        self.vietnamese = np.empty(size, dtype=object)
+        for class_id, name in names.items():
+            self.known[class_id] = True
+            self.english[class_id] = name
+            self.vietnamese[class_id] = translations.get(name, name)
+        for table in (self.known, self.english, self.vietnamese):
+            table.flags.writeable = False
+
+        class_ids = sorted(names)
+        self.classes_body = json.dumps({
+            'success': True,
+            'classes': [self.vietnamese[i] for i in class_ids],
+            'english_classes': [names[i] for i in class_ids],
+            'class_mapping': {i: {'english': names[i], 'vietnamese': self.vietnamese[i]} for i in class_ids},
+            'total_classes': len(class_ids)
+        }, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        self.etag = hashlib.sha256(self.classes_body).hexdigest()[:32]
+
+class_registry = ClassRegistry({})  # Thay bằng registry của model khi load xong
+# Bảng tra theo class_id cho bước post-processing
+class_known, class_names_en, class_names_vi = class_registry.known, class_registry.english, class_registry.vietnamese
+
+# ==================== RESULT CACHE ====================
+
+class LRUCache:
+    """LRU cache giới hạn kích thước, có TTL và đếm hit/miss"""
+
+    def __init__(self, max_size=512, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.data[key]
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+detect_cache = LRUCache(max_size=DETECT_CACHE_SIZE, ttl=DETECT_CACHE_TTL)
+
+def detect_cache_key(data, conf):
+    """Key cache = hash nội dung ảnh + ngưỡng confidence"""
+    return f"{hashlib.sha256(data).hexdigest()}:{conf}"
+
+class RecipeCache:
+    """
+    Cache công thức theo tập nguyên liệu đã chuẩn hóa.
+    Giữ LRU trong RAM, có thể lưu thêm vào SQLite để không mất khi restart
+    (bản ghi quá TTL được xóa bởi purge() trong thread dọn dẹp).
+    """
+
+    def __init__(self, max_size=256, ttl=86400, db_path=''):
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.ttl = ttl
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.purged = 0
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS recipes (key TEXT PRIMARY KEY, recipe TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            self.db.execute('CREATE INDEX IF NOT EXISTS recipes_created_at ON recipes (created_at)')
+            self.db.commit()
+
+    def get(self, key):
+        recipe = self.memory.get(key)
+        if recipe is not None:
+            return recipe
+        return self.load(key)
+
+    def load(self, key):
+        """Đọc từ SQLite (chặn, asgi.py gọi trên thread pool) và đưa vào LRU; None nếu không có"""
+        if self.db is None:
+            return None
+        with self.db_lock:
+            row = self.db.execute(
+                'SELECT recipe FROM recipes WHERE key = ? AND created_at > ?',
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def set(self, key, recipe):
+        self.memory.set(key, recipe)
+        self.persist(key, recipe)
+
+    def persist(self, key, recipe):
+        """Ghi vào SQLite (chặn, asgi.py gọi trên thread pool)"""
+        if self.db is not None:
+            with self.db_lock:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO recipes (key, recipe, created_at) VALUES (?, ?, ?)',
+                    (key, recipe, time.time())
+                )
+                self.db.commit()
+
+    def purge(self):
+        """Xóa bản ghi SQLite đã quá TTL để file không lớn mãi, trả về số bản ghi bị xóa"""
+        if self.db is None:
+            return 0
+        with self.db_lock:
+            removed = self.db.execute('DELETE FROM recipes WHERE created_at <= ?', (time.time() - self.ttl,)).rowcount
+            self.db.commit()
+        self.purged += removed
+        return removed
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats['persistent'] = self.db is not None
+        stats['purged'] = self.purged
+        return stats
+
+recipe_cache = RecipeCache(max_size=RECIPE_CACHE_SIZE, ttl=RECIPE_CACHE_TTL, db_path=RECIPE_CACHE_DB)
+
+def canonical_ingredients(ingredients):
+    """Chuẩn hóa danh sách nguyên liệu: bỏ khoảng trắng, bỏ trùng, sắp xếp"""
+    unique = {}
+    for name in ingredients:
+        name = unicodedata.normalize('NFC', str(name)).strip()
+        if name:
+            unique.setdefault(name.casefold(), name)
+    return [unique[key] for key in sorted(unique)]
+
+def recipe_cache_key(ingredients):
+    """Key cache = tập nguyên liệu đã chuẩn hóa (không phân biệt thứ tự, hoa thường)"""
+    return '|'.join(name.casefold() for name in ingredients)
+
+# ==================== INFERENCE SCHEDULER ====================
+
+class InferenceScheduler:
+    """
+    Gom các ảnh từ nhiều request /detect thành batch động rồi chạy YOLO một lần.
+    Mỗi request nhận về Future chứa detections [(class_ids, confidences)] của riêng ảnh đó.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, source, conf=DETECT_CONF):
+        """Đưa ảnh vào hàng đợi, trả về Future với detections của ảnh"""
+        future = Future()
+        self.queue.put((source, conf, future))
+        return future
+
+    def _collect_batch(self):
+        # Chờ request đầu tiên, sau đó gom thêm tới khi đủ batch hoặc hết thời gian chờ
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Mỗi lần gọi model chỉ dùng một ngưỡng conf
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for conf, items in groups.items():
+                self._infer(items, conf)
+
+    def _infer(self, items, conf):
+        sources = [source for source, _, _ in items]
+        try:
+            with stage_seconds.time('yolo_batch'):
+                results = self.model(sources, conf=conf, imgsz=YOLO_IMGSZ, verbose=False)
+            for (_, _, future), result in zip(items, results):
+                future.set_result([extract_detections(result)])
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+
+inference_scheduler = None
+detection_pool = None
+# /detect và /detect-batch chỉ cần submit(image, conf) -> Future
+detector = None
+
+def start_worker_pool():
+    """
+    Export model (nếu cần) rồi khởi động DETECT_WORKERS process, mỗi process load + warm-up model riêng.
+    Process API không load model: tên class lấy từ worker. Trả về None nếu không khởi động được.
+    """
+    logger.info("🔄 Starting %d detection workers (%d threads each)...", DETECT_WORKERS, DETECT_WORKER_THREADS)
+    try:
+        pool = DetectionWorkerPool(
+            prepare_model_path(),
+            workers=DETECT_WORKERS,
+            threads=DETECT_WORKER_THREADS,
+            imgsz=YOLO_IMGSZ,
+            slot_mb=DETECT_WORKER_SLOT_MB,
+            warmup_runs=YOLO_WARMUP_RUNS,
+            pin_cpus=DETECT_WORKER_PIN_CPUS
+        )
+        logger.info("✅ Detection workers ready")
+        return pool
+    except Exception as e:
+        logger.error("❌ Failed to start detection workers, falling back to in-process inference: %s", e)
+        return None
+
+def load_detector():
+    """Khởi động worker pool hoặc load + warm-up model trong process, tạo class registry rồi mới công bố model_loaded"""
+    global yolo_model, model_loaded, class_registry, class_known, class_names_en, class_names_vi
+    global inference_scheduler, detection_pool, detector
+    try:
+        started = time.perf_counter()
+        model, pool, scheduler = None, None, None
+        if DETECT_WORKERS > 0:
+            pool = start_worker_pool()
+        if pool is not None:
+            names = pool.names
+            startup_timings['detector_start'] = time.perf_counter() - started
+        else:
+            logger.info("🔄 Loading YOLO model...")
+            model = load_yolo_model()
+            loaded = time.perf_counter()
+            warmup_yolo_model(model)
+            warmed = time.perf_counter()
+            scheduler = InferenceScheduler(
+                model,
+                # Model export với input cố định chỉ nhận batch 1
+                max_batch_size=DETECT_BATCH_SIZE if YOLO_BACKEND == 'pytorch' or YOLO_DYNAMIC else 1,
+                max_wait_ms=DETECT_BATCH_MAX_WAIT_MS
+            )
+            names = model.names
+            startup_timings['model_load'] = loaded - started
+            startup_timings['model_warmup'] = warmed - loaded
+            startup_timings['detector_start'] = time.perf_counter() - warmed
+        registry = ClassRegistry(names)
+
+        yolo_model = model
+        class_registry = registry
+        class_known, class_names_en, class_names_vi = registry.known, registry.english, registry.vietnamese
+        detection_pool, inference_scheduler = pool, scheduler
+        detector = pool or scheduler
+        model_loaded = True
+        model_state['status'] = 'ready'
+
+        startup_timings['ready'] = time.perf_counter() - STARTUP_STARTED
+        logger.info("✅ YOLO detector ready (%s, %s)! Ready %.2fs after start. Classes: %s",
+                    YOLO_BACKEND, f"{DETECT_WORKERS} workers" if pool else 'in-process',
+                    startup_timings['ready'], list(names.values()))
+    except Exception as e:
+        logger.error("❌ Failed to load YOLO model: %s", e)
+        model_state['status'] = 'failed'
+        model_state['error'] = str(e)
+    finally:
+        model_ready.set()
+
+def wait_for_model(timeout=None):
+    """Chờ thread load model xong (cho script/benchmark), trả về model_loaded"""
+    start_background_services()
+    model_ready.wait(timeout)
+    return model_loaded
+
+def model_unavailable_response(**extra):
+    """503 + Retry-After khi model đang load, 500 nếu load lỗi"""
+    if model_state['status'] == 'loading':
+        response = jsonify({
+            'error': 'YOLO model is warming up, please retry shortly',
+            'status': 'warming_up',
+            'success': False,
+            **extra
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(YOLO_LOADING_RETRY_AFTER)
+        return response
+    return jsonify({'error': 'YOLO model not loaded', 'success': False, **extra}), 500
 
 # ==================== SESSION MANAGEMENT ====================
 
@@ -123,17 +679,16 @@ def start_chat():
         
         session_id = str(uuid.uuid4())
         
-        with session_lock:
-            chat_sessions[session_id] = {
-                'session_id': session_id,
-                'ingredients': ingredients,
-                'recipe': recipe,
-                'messages': [],
-                'created_at': datetime.now(),
-                'last_activity': datetime.now()
-            }
+        session_store.create({
+            'session_id': session_id,
+            'ingredients': ingredients,
+            'recipe': recipe,
+            'messages': [],
+            'created_at': datetime.now(),
+            'last_activity': datetime.now()
+        })
         
-        print(f"✅ Created chat session: {session_id}")
+        request_logger.info("✅ Created chat session: %s", session_id)
         
         return jsonify({
             'success': True,
@@ -142,7 +697,7 @@ def start_chat():
         })
         
     except Exception as e:
-        print(f"❌ Start chat error: {str(e)}")
+        logger.error("❌ Start chat error: %s", e)
         return jsonify({
             'error': f'Failed to start chat: {str(e)}',
             'success': False
@@ -157,11 +712,7 @@ def detect_ingredients():
     """
     try:
         if not model_loaded:
-            return jsonify({
-                'error': 'YOLO model not loaded',
-                'success': False,
-                'ingredients': []
-            }), 500
+            return model_unavailable_response(ingredients=[])
         
         # Kiểm tra có file trong request không
         if 'image' not in request.files:
@@ -182,106 +733,42 @@ def detect_ingredients():
             }), 400
         
         if file and allowed_file(file.filename):
-            temp_file_path = None
             try:
-                # Lưu tạm thời với proper error handling
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                    file.save(temp_file.name)
-                    temp_file_path = temp_file.name
-                
-                print(f"🖼️ Processing image: {temp_file_path}")
+                with stage_seconds.time('upload_read'):
+                    data = file.read()
                 
-                # Chạy YOLO detection với error handling
-                results = yolo_model(temp_file_path, conf=0.3)
-                print(f"🔍 YOLO results: {len(results)} result(s)")
+                # Ảnh đã detect trước đó thì trả kết quả từ cache, không chờ model
+                cache_key = detect_cache_key(data, DETECT_CONF)
+                cached = detect_cache.get(cache_key)
+                if cached is not None:
+                    return jsonify({'success': True, **cached, 'cached': True})
                 
-                # Lấy tên nguyên liệu
-                detailed_results = []
+                # Decode ảnh trực tiếp trong bộ nhớ (thu nhỏ về kích thước input), không ghi file tạm
+                with stage_seconds.time('preprocess'):
+                    image = decode_image(data)
                 
-                for result in results:
-                    print(f"📊 Processing result with {len(result.boxes) if result.boxes is not None else 0} boxes")
-                    
-                    if result.boxes is not None and len(result.boxes) > 0:
-                        for i, box in enumerate(result.boxes):
-                            try:
-                                # Safely extract values
-                                class_id = int(box.cls[0].item()) 
-                                confidence = float(box.conf[0].item())
-                                
-                                # Check if class_id exists in model names
-                                if class_id in yolo_model.names:
-                                    class_name = yolo_model.names[class_id]
-                                    
-                                    detailed_results.append({
-                                        'name': class_name,
-                                        'confidence': confidence,
-                                        'class_id': class_id
-                                    })
-                                    
-                                    print(f"  ✅ Box {i}: {class_name} (confidence: {confidence:.3f})")
-                                else:
-                                    print(f"  ⚠️ Box {i}: Unknown class_id {class_id}")
-                                    
-                            except Exception as box_error:
-                                print(f"  ❌ Error processing box {i}: {str(box_error)}")
-                                continue
+                request_logger.debug("🖼️ Processing image: %s (%dx%d)", file.filename, image.shape[1], image.shape[0])
                 
-                print(f"📋 Total detections: {len(detailed_results)}")
+                # Chạy YOLO detection qua scheduler (gom batch với các request khác)
+                with stage_seconds.time('yolo_inference'):
+                    detections = detector.submit(image, conf=DETECT_CONF).result()
                 
-                # Chỉ trả về tên, không trùng, sắp xếp theo confidence
-                unique_ingredients = {}
-                for item in detailed_results:
-                    name = item['name']
-                    if name not in unique_ingredients or item['confidence'] > unique_ingredients[name]['confidence']:
-                        unique_ingredients[name] = item
+                with stage_seconds.time('postprocess'):
+                    payload = postprocess_detections(detections)
+                detect_cache.set(cache_key, payload)
                 
-                # Sort theo confidence giảm dần
-                sorted_results = sorted(unique_ingredients.values(), key=lambda x: x['confidence'], reverse=True)
+                request_logger.info("🎯 Final ingredients (VI): %s", payload['ingredients'])
                 
-                # Translate ingredients to Vietnamese
-                final_ingredients = []
-                translated_results = []
-                
-                for item in sorted_results:
-                    english_name = item['name']
-                    vietnamese_name = datamap(english_name)
-                    
-                    final_ingredients.append(vietnamese_name)
-                    translated_results.append({
-                        'name': vietnamese_name,
-                        'english_name': english_name,
-                        'confidence': item['confidence'],
-                        'class_id': item['class_id']
-                    })
-                
-                print(f"🎯 Final ingredients (EN): {[item['name'] for item in sorted_results]}")
-                print(f"🎯 Final ingredients (VI): {final_ingredients}")
-                
-                return jsonify({
-                    'success': True,
-                    'ingredients': final_ingredients,
-                    'detailed_results': translated_results,
-                    'total_detected': len(final_ingredients)
-                })
+                return jsonify({'success': True, **payload, 'cached': False})
                 
             except Exception as detection_error:
-                print(f"❌ Detection error: {str(detection_error)}")
-                print(f"📍 Error traceback: {traceback.format_exc()}")
+                logger.error("❌ Detection error: %s\n📍 Error traceback: %s", detection_error, traceback.format_exc())
                 
                 return jsonify({
                     'error': f'Detection failed: {str(detection_error)}',
                     'success': False,
                     'ingredients': []
                 }), 500
-            
-            finally:
-                # Cleanup temp file
-                if temp_file_path and os.path.exists(temp_file_path):
-                    try:
-                        os.unlink(temp_file_path)
-                        print(f"🗑️ Cleaned up temp file: {temp_file_path}")
-                    except Exception as cleanup_error:
-                        print(f"⚠️ Failed to cleanup temp file: {str(cleanup_error)}")
         
         return jsonify({
             'error': 'Invalid file type. Supported: png, jpg, jpeg, gif, bmp, webp',
@@ -290,78 +777,305 @@ def detect_ingredients():
         }), 400
         
     except Exception as e:
-        print(f"❌ Main error in detect_ingredients: {str(e)}")
-        print(f"📍 Error traceback: {traceback.format_exc()}")
+        logger.error("❌ Main error in detect_ingredients: %s\n📍 Error traceback: %s", e, traceback.format_exc())
         return jsonify({
             'error': f'Server error: {str(e)}',
             'success': False,
             'ingredients': []
         }), 500
 
-def allowed_file(filename):
-    """Kiểm tra file có hợp lệ không"""
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def extract_detections(result):
+    """Lấy (class_ids, confidences) dạng numpy từ một kết quả YOLO"""
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    return boxes.cls.cpu().numpy().astype(np.int64), boxes.conf.cpu().numpy().astype(np.float64)
 
-@app.route('/classes', methods=['GET'])
-def get_classes():
+def postprocess_results(results, conf=DETECT_CONF):
+    """Post-processing trực tiếp từ kết quả YOLO"""
+    return postprocess_detections([extract_detections(result) for result in results], conf)
+
+def postprocess_detections(detections, conf=DETECT_CONF):
     """
-    API để lấy danh sách các class mà model có thể detect
+    Chuyển detections [(class_ids, confidences), ...] thành danh sách nguyên liệu
+    (không trùng, sắp theo confidence, tiếng Việt).
+    Xử lý trên cả mảng: lọc ngưỡng, lấy confidence cao nhất mỗi class, sắp xếp rồi tra bảng tên.
     """
-    if not model_loaded:
-        return jsonify({
-            'error': 'YOLO model not loaded',
-            'success': False
-        }), 500
-    
-    # Get English classes and translate to Vietnamese
-    english_classes = list(yolo_model.names.values())
-    vietnamese_classes = [datamap(cls) for cls in english_classes]
+    best, total = class_confidences(detections, conf)
+    request_logger.debug("📋 Total detections: %d", total)
+    return ingredients_payload(best, np.flatnonzero(best >= 0))
+
+def class_confidences(detections, conf=DETECT_CONF):
+    """Confidence cao nhất của mỗi class_id (-1 nếu không có box nào) và số box được giữ"""
+    best = np.full(len(class_known), -1.0)
+    total = 0
+    for class_ids, confidences in detections:
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        confidences = np.asarray(confidences, dtype=np.float64)
+        # Bỏ box dưới ngưỡng và class_id không có trong model
+        in_range = (class_ids >= 0) & (class_ids < len(class_known))
+        keep = in_range & (confidences >= conf)
+        keep[keep] = class_known[class_ids[keep]]
+        np.maximum.at(best, class_ids[keep], confidences[keep])
+        total += int(keep.sum())
+    return best, total
+
+def ingredients_payload(scores, found):
+    """Payload nguyên liệu cho các class_id trong found, mỗi class một dòng, sắp theo scores giảm dần"""
+    order = found[np.argsort(-scores[found], kind='stable')]
     
-    # Create mapping for reference
-    class_mapping = {}
-    for i, english_name in enumerate(english_classes):
-        vietnamese_name = datamap(english_name)
-        class_mapping[i] = {
-            'english': english_name,
-            'vietnamese': vietnamese_name
+    final_ingredients = class_names_vi[order].tolist()
+    translated_results = [
+        {
+            'name': vietnamese_name,
+            'english_name': english_name,
+            'confidence': confidence,
+            'class_id': class_id
         }
+        for vietnamese_name, english_name, confidence, class_id in zip(
+            final_ingredients, class_names_en[order].tolist(), scores[order].tolist(), order.tolist()
+        )
+    ]
     
-    return jsonify({
-        'success': True,
-        'classes': vietnamese_classes,
-        'english_classes': english_classes,
-        'class_mapping': class_mapping,
-        'total_classes': len(english_classes)
-    })
+    return {
+        'ingredients': final_ingredients,
+        'detailed_results': translated_results,
+        'total_detected': len(final_ingredients)
+    }
 
-# ==================== LM STUDIO RECIPE API ====================
+def merge_detailed_results(detailed_results):
+    """Gộp kết quả nhiều ảnh: mỗi nguyên liệu giữ confidence cao nhất, sắp xếp giảm dần"""
+    unique_ingredients = {}
+    for item in detailed_results:
+        name = item['english_name']
+        if name not in unique_ingredients or item['confidence'] > unique_ingredients[name]['confidence']:
+            unique_ingredients[name] = item
+    merged = sorted(unique_ingredients.values(), key=lambda x: x['confidence'], reverse=True)
+    return {
+        'ingredients': [item['name'] for item in merged],
+        'detailed_results': merged,
+        'total_detected': len(merged)
+    }
 
-@app.route('/generate-recipe', methods=['POST'])
-def generate_recipe():
+def exif_oriented(img):
+    """Xoay ảnh theo tag EXIF Orientation (ảnh điện thoại chụp dọc), không tạo bản sao nếu không cần"""
+    if img.getexif().get(0x0112, 1) != 1:
+        return ImageOps.exif_transpose(img)
+    return img
+
+def decode_image(data, max_side=YOLO_IMGSZ):
     """
-    API endpoint để tạo công thức từ nguyên liệu
+    Decode bytes ảnh upload thành numpy array BGR (định dạng YOLO dùng cho array),
+    thu nhỏ để cạnh dài nhất không vượt quá kích thước input của model.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        # Chỉ đọc header, từ chối ảnh quá lớn trước khi giải mã
+        width, height = img.size
+        if width * height > DETECT_MAX_IMAGE_PIXELS:
+            raise ValueError(f'Image too large ({width}x{height}, max {DETECT_MAX_IMAGE_PIXELS} pixels)')
+        # JPEG: giải mã thẳng ở tỉ lệ 1/2, 1/4 hoặc 1/8 (draft mode), vẫn không nhỏ hơn max_side
+        img.draft('RGB', (max_side, max_side))
+        img = exif_oriented(img).convert('RGB')
+        # YOLO sẽ letterbox về max_side, thu nhỏ trước để bước này không tốn thêm
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.BILINEAR)
+        rgb = np.asarray(img)
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+@app.route('/detect-batch', methods=['POST'])
+def detect_ingredients_batch():
+    """
+    Detect nguyên liệu từ nhiều ảnh trong một request (multipart, key: images).
+    Trả về kết quả từng ảnh và danh sách nguyên liệu đã gộp.
     """
     try:
-        data = request.get_json()
+        if not model_loaded:
+            return model_unavailable_response(ingredients=[])
         
-        if not data or 'ingredients' not in data:
+        files = [f for f in request.files.getlist('images') if f and f.filename]
+        if not files:
             return jsonify({
-                'error': 'No ingredients provided',
-                'success': False
+                'error': 'No image files provided',
+                'success': False,
+                'ingredients': []
             }), 400
         
-        ingredients = data['ingredients']
-        
-        if not ingredients:
+        if len(files) > DETECT_MAX_BATCH_IMAGES:
             return jsonify({
-                'error': 'Ingredients list is empty',
-                'success': False
+                'error': f'Too many images (max {DETECT_MAX_BATCH_IMAGES})',
+                'success': False,
+                'ingredients': []
             }), 400
         
-        # Tạo prompt cho LM Studio
-        ingredients_text = ', '.join(ingredients)
-        prompt = f"""
+        # Đọc, kiểm tra cache và decode từng ảnh; ảnh lỗi chỉ làm hỏng kết quả của chính nó
+        images = []
+        for index, file in enumerate(files):
+            entry = {'filename': file.filename}
+            images.append(entry)
+            if not allowed_file(file.filename):
+                entry['error'] = 'Invalid file type. Supported: png, jpg, jpeg, gif, bmp, webp'
+                continue
+            with stage_seconds.time('upload_read'):
+                data = file.read()
+            entry['cache_key'] = detect_cache_key(data, DETECT_CONF)
+            cached = detect_cache.get(entry['cache_key'])
+            if cached is not None:
+                entry['payload'] = cached
+                entry['cached'] = True
+                continue
+            try:
+                with stage_seconds.time('preprocess'):
+                    entry['image'] = decode_image(data)
+            except Exception as decode_error:
+                entry['error'] = f'Cannot decode image: {str(decode_error)}'
+        
+        # Đưa tất cả ảnh cần detect vào scheduler cùng lúc để chạy chung batch
+        pending = [entry for entry in images if 'image' in entry]
+        with stage_seconds.time('yolo_inference'):
+            futures = [detector.submit(entry.pop('image'), conf=DETECT_CONF) for entry in pending]
+            for entry, future in zip(pending, futures):
+                try:
+                    detections = future.result()
+                    with stage_seconds.time('postprocess'):
+                        entry['payload'] = postprocess_detections(detections)
+                    entry['cached'] = False
+                    detect_cache.set(entry['cache_key'], entry['payload'])
+                except Exception as detection_error:
+                    entry['error'] = f'Detection failed: {str(detection_error)}'
+        
+        per_image = []
+        all_detailed = []
+        for entry in images:
+            if 'payload' in entry:
+                all_detailed.extend(entry['payload']['detailed_results'])
+                per_image.append({
+                    'filename': entry['filename'],
+                    'success': True,
+                    **entry['payload'],
+                    'cached': entry['cached']
+                })
+            else:
+                per_image.append({
+                    'filename': entry['filename'],
+                    'success': False,
+                    'error': entry['error'],
+                    'ingredients': []
+                })
+        
+        merged = merge_detailed_results(all_detailed)
+        request_logger.info("🎯 Batch of %d image(s), merged ingredients: %s", len(files), merged['ingredients'])
+        
+        return jsonify({
+            'success': any(item['success'] for item in per_image),
+            **merged,
+            'images': per_image,
+            'total_images': len(per_image)
+        })
+        
+    except Exception as e:
+        logger.error("❌ Main error in detect_ingredients_batch: %s\n📍 Error traceback: %s", e, traceback.format_exc())
+        return jsonify({
+            'error': f'Server error: {str(e)}',
+            'success': False,
+            'ingredients': []
+        }), 500
+
+def allowed_file(filename):
+    """Kiểm tra file có hợp lệ không"""
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# ==================== STREAMING DETECTION ====================
+
+stream_frames_total = REGISTRY.counter('food_app_stream_frames_total', 'Frames received on /detect-stream', ['result'])
+
+def frame_thumbnail(data, size=32):
+    """Ảnh xám size x size của frame (JPEG giải mã ở tỉ lệ 1/8) để so sánh nhanh hai frame"""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft('L', (size * 2, size * 2))
+        return np.asarray(exif_oriented(img).convert('L').resize((size, size), Image.BILINEAR), dtype=np.int16)
+
+class DetectionStream:
+    """
+    Trạng thái detect của một luồng frame (camera kiosk qua /detect-stream).
+    Frame gần giống frame đã detect gần nhất bị bỏ qua; confidence mỗi class được cộng dồn
+    qua các frame (EMA) với ngưỡng vào/ra riêng để nguyên liệu không nhấp nháy theo từng frame.
+    """
+
+    def __init__(self, diff_threshold=DETECT_STREAM_DIFF_THRESHOLD, alpha=DETECT_STREAM_EMA_ALPHA,
+                 enter_score=DETECT_STREAM_ENTER_SCORE, leave_score=DETECT_STREAM_LEAVE_SCORE):
+        self.diff_threshold = diff_threshold * 255
+        self.alpha = alpha
+        self.enter_score = enter_score
+        self.leave_score = leave_score
+        self.scores = np.zeros(len(class_known))
+        self.present = np.zeros(len(class_known), dtype=bool)
+        self.last_thumbnail = None
+        self.started = time.monotonic()
+        self.frames = {'received': 0, 'processed': 0, 'skipped': 0, 'dropped': 0}
+
+    def count(self, result):
+        self.frames[result] += 1
+        stream_frames_total.inc(result)
+
+    def changed(self, data):
+        """True nếu frame khác đủ nhiều so với frame đã detect gần nhất"""
+        thumbnail = frame_thumbnail(data)
+        if self.last_thumbnail is not None and np.abs(thumbnail - self.last_thumbnail).mean() < self.diff_threshold:
+            return False
+        self.last_thumbnail = thumbnail
+        return True
+
+    def update(self, detections):
+        """Cộng dồn kết quả một frame; trả về payload cập nhật nếu danh sách nguyên liệu thay đổi, ngược lại None"""
+        best, _ = class_confidences(detections)
+        self.scores = (1 - self.alpha) * self.scores + self.alpha * np.maximum(best, 0)
+        present = np.where(self.present, self.scores >= self.leave_score, self.scores >= self.enter_score)
+        added = np.flatnonzero(present & ~self.present)
+        removed = np.flatnonzero(self.present & ~present)
+        self.present = present
+        if len(added) == 0 and len(removed) == 0:
+            return None
+        payload = self.snapshot()
+        payload['added'] = class_names_vi[added].tolist()
+        payload['removed'] = class_names_vi[removed].tolist()
+        return payload
+
+    def snapshot(self):
+        """Danh sách nguyên liệu hiện tại (confidence = điểm cộng dồn)"""
+        return ingredients_payload(self.scores, np.flatnonzero(self.present))
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            **self.frames,
+            'processed_fps': round(self.frames['processed'] / elapsed, 2),
+            'duration_s': round(elapsed, 2)
+        }
+
+@app.route('/classes', methods=['GET'])
+def get_classes():
+    """
+    API để lấy danh sách các class mà model có thể detect
+    """
+    if not model_loaded:
+        return model_unavailable_response()
+    
+    # Class của model không đổi khi chạy: trả body đã serialize sẵn, 304 nếu client gửi đúng ETag
+    response = Response(class_registry.classes_body, mimetype='application/json')
+    response.set_etag(class_registry.etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True  # Vẫn hỏi lại server, nhưng chỉ nhận 304 khi không đổi
+    return response.make_conditional(request)
+
+# ==================== LM STUDIO RECIPE API ====================
+
+RECIPE_SYSTEM_PROMPT = "Bạn là đầu bếp chuyên nghiệp, chuyên món ăn Việt Nam. Trả lời bằng tiếng Việt."
+
+def build_recipe_messages(ingredients):
+    """Tạo messages gửi LM Studio để sinh công thức từ nguyên liệu"""
+    ingredients_text = ', '.join(ingredients)
+    prompt = f"""
 Bạn là một đầu bếp Việt Nam chuyên nghiệp. Bạn chỉ được phép trả lời về các món ăn Việt Nam, đặc biệt là đưa ra gợi ý món ăn dựa trên nguyên liệu có sẵn.
 Từ các nguyên liệu: {ingredients_text}
 
@@ -387,194 +1101,371 @@ Trả về định dạng text thường, không thêm các tag HTML hay Markdow
 Khi người dùng hỏi về món ăn này, hãy trả lời bằng tiếng Việt và cung cấp công thức chi tiết.
 Nếu hỏi các câu hỏi ngoài lĩnh vực này, hãy trả lời rằng bạn chỉ chuyên về món ăn Việt Nam và không thể cung cấp thông tin khác.
 """
+    return [
+        {"role": "system", "content": RECIPE_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def recipe_completion(ingredients):
+    """Tham số chat.completions.create (stream) để sinh công thức"""
+    return {
+        'model': model,
+        'messages': build_recipe_messages(ingredients),
+        'stream': True,
+        'temperature': 0.7
+    }
+
+def parse_recipe_request(data):
+    """(nguyên liệu đã chuẩn hóa, None) hoặc (None, body lỗi 400) cho body của /generate-recipe"""
+    if not data or 'ingredients' not in data:
+        return None, {'error': 'No ingredients provided', 'success': False}
+    ingredients = canonical_ingredients(data['ingredients'])
+    if not ingredients:
+        return None, {'error': 'Ingredients list is empty', 'success': False}
+    return ingredients, None
+
+def recipe_result(recipe, ingredients, cached, leader=True):
+    """Kết quả công thức: body của /generate-recipe (thêm success) và sự kiện done của bản stream"""
+    result = {
+        'recipe': recipe,
+        'ingredients_used': ingredients,
+        'cached': cached
+    }
+    if not cached:
+        result['coalesced'] = not leader
+    return result
+
+def cached_recipe_events(recipe, ingredients):
+    """Các frame SSE trả công thức có sẵn trong cache"""
+    return [
+        sse.event({'content': recipe, 'type': 'chunk'}),
+        sse.event({'type': 'done', **recipe_result(recipe, ingredients, cached=True)})
+    ]
+
+def recipe_done_event(frames, ingredients, leader):
+    return sse.event({'type': 'done', **recipe_result(frames.text(), ingredients, cached=False, leader=leader)})
+
+# Các request cùng tập nguyên liệu đang chờ LM Studio dùng chung một lời gọi
+recipe_flights = SingleFlight()
+
+def produce_recipe(flight, ingredients, cache_key):
+    """Gọi LM Studio (stream) cho một flight, publish từng chunk và lưu cache khi xong"""
+    with llm_gateway.acquire('recipe'):
+        flight.admit()
+        timings = LLMTimings()
+        response = client.chat.completions.create(**recipe_completion(ingredients))
+        for chunk in response:
+            content = timings.delta(chunk)
+            if content:
+                flight.publish(content)
+        timings.finish()
+    recipe = flight.text()
+    if recipe:
+        recipe_cache.set(cache_key, recipe)
+
+def join_recipe_flight(ingredients, cache_key):
+    """Trả về (flight, leader): flight đang chạy cho tập nguyên liệu này hoặc flight mới"""
+    return recipe_flights.run(cache_key, lambda flight: produce_recipe(flight, ingredients, cache_key))
+
+@app.route('/generate-recipe', methods=['POST'])
+def generate_recipe():
+    """
+    API endpoint để tạo công thức từ nguyên liệu
+    """
+    try:
+        ingredients, error = parse_recipe_request(request.get_json())
+        if error:
+            return jsonify(error), 400
+        
+        # Tập nguyên liệu đã từng tạo công thức thì trả về ngay từ cache
+        cache_key = recipe_cache_key(ingredients)
+        cached_recipe = recipe_cache.get(cache_key)
+        if cached_recipe is not None:
+            return jsonify({'success': True, **recipe_result(cached_recipe, ingredients, cached=True)})
+        
         try:
-            print("🤖 Calling LM Studio API...")
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "Bạn là đầu bếp chuyên nghiệp, chuyên món ăn Việt Nam. Trả lời bằng tiếng Việt."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-            )
-            
-            recipe = response.choices[0].message.content
-            print("✅ Recipe generated successfully")
-            
-            return jsonify({
-                'success': True,
-                'recipe': recipe,
-                'ingredients_used': ingredients
-            })
+            flight, leader = join_recipe_flight(ingredients, cache_key)
+            request_logger.info("🤖 %s LM Studio API...", 'Calling' if leader else 'Joining in-flight call to')
+            recipe = flight.result()
+            request_logger.info("✅ Recipe generated successfully")
+            return jsonify({'success': True, **recipe_result(recipe, ingredients, cached=False, leader=leader)})
             
+        except LLMBusyError as busy:
+            return llm_busy_response(busy)
         except Exception as api_error:
-            print(f"❌ LM Studio API error: {str(api_error)}")
-            return jsonify({
-                'error': f'Không thể kết nối tới LM Studio API. Vui lòng kiểm tra: {str(api_error)}',
-                'success': False,
-                'troubleshooting': [
-                    'Kiểm tra LM Studio có đang chạy không (localhost:1234)',
-                    'Kiểm tra model đã được load chưa',
-                    'Kiểm tra kết nối mạng',
-                    'Xem lại cấu hình API endpoint'
-                ]
-            }), 503
+            return jsonify(llm_error_payload(api_error)), 503
             
     except Exception as e:
-        print(f"❌ Generate recipe error: {str(e)}")
-        return jsonify({
-            'error': f'Server error: {str(e)}',
-            'success': False
-        }), 500
+        logger.error("❌ Generate recipe error: %s", e)
+        return jsonify(server_error_payload(e)), 500
+
+@app.route('/generate-recipe-stream', methods=['POST'])
+def generate_recipe_stream():
+    """Tạo công thức với streaming response (cùng định dạng data: {...} như /chat-stream)"""
+    data = request.get_json(silent=True) or {}
+    ingredients = canonical_ingredients(data.get('ingredients') or [])
+    cache_key = recipe_cache_key(ingredients)
+    cached_recipe = recipe_cache.get(cache_key) if ingredients else None
+    # Chờ lời gọi LM Studio (của request này hoặc request trùng nguyên liệu) qua hàng đợi
+    # trước khi trả header, để có thể trả về 429/503
+    flight, leader = None, True
+    if ingredients and cached_recipe is None:
+        flight, leader = join_recipe_flight(ingredients, cache_key)
+        try:
+            flight.wait_admitted()
+        except LLMBusyError as busy:
+            return llm_busy_response(busy)
+
+    @stream_with_context
+    def generate_response():
+        try:
+            if not ingredients:
+                yield error_event('No ingredients provided')
+                return
+            if cached_recipe is not None:
+                yield from cached_recipe_events(cached_recipe, ingredients)
+                return
+            request_logger.info("🤖 Streaming recipe from LM Studio%s...", '' if leader else ' (joined in-flight call)')
+            try:
+                # Người vào sau nhận lại các chunk đã có rồi tiếp tục theo lời gọi đang chạy
+                frames = frame_coalescer()
+                yield from sse.stream_frames(flight.stream(), frames)
+                yield recipe_done_event(frames, ingredients, leader)
+                request_logger.info("✅ Recipe streaming completed")
+            except Exception as api_error:
+                yield error_event(llm_error_message(api_error))
+        except Exception as e:
+            logger.error("❌ Generate recipe stream error: %s", e)
+            yield error_event(str(e))
+
+    return Response(generate_response(), mimetype=sse.MEDIA_TYPE, headers=SSE_HEADERS)
 
 # ==================== CHAT API WITH CONTEXT & STREAMING ====================
 
+chat_streams_cancelled = REGISTRY.counter(
+    'food_app_chat_streams_cancelled_total', 'Chat streams closed by the client before the answer finished'
+)
+
+def build_chat_context(session, question):
+    """
+    Tạo messages (system prompt + lịch sử + câu hỏi) cho LM Studio trong giới hạn
+    CHAT_CONTEXT_TOKEN_BUDGET, bỏ hoặc rút gọn lượt cũ nhất trước.
+    Trả về (messages, số token ước lượng của prompt).
+    """
+    # Build context from previous messages
+    ingredients_text = ', '.join(session['ingredients']) if session['ingredients'] else "các nguyên liệu có sẵn"
+    recipe_context = session['recipe'][:400] if session['recipe'] else ""
+    system_prompt = f"""
+        Bạn là một chuyên gia ẩm thực Việt Nam chuyên nghiệp. 
+        Bạn chỉ có thể trả lời các câu hỏi liên quan đến nấu ăn, nguyên liệu, món ăn, công thức hoặc mẹo vặt nhà bếp.
+
+        Nguyên liệu hiện có: {ingredients_text}
+        Công thức đang thảo luận: {recipe_context}
+
+        QUY TẮC BẮT BUỘC:
+        - Bạn TUYỆT ĐỐI KHÔNG được trả lời bất kỳ nội dung nào ngoài nấu ăn, kể cả khi người dùng hỏi về lập trình, khoa học, game, hay bất kỳ lĩnh vực nào khác. Bạn chỉ được phép nói đúng câu: "Xin lỗi tôi chỉ có thể trả lời về nấu ăn. Nếu bạn có câu hỏi nào khác, hãy cho tôi biết."
+        - KHÔNG được suy luận hoặc trả lời bất kỳ thông tin nào ngoài lĩnh vực ẩm thực.
+        - Trả lời ngắn gọn, dễ hiểu, đúng trọng tâm, bằng tiếng Việt.
+        - KHÔNG dùng HTML, Markdown, hoặc ký tự đặc biệt.
+        - Trả lời theo dạng văn bản thường, không có định dạng phức tạp, xuống dòng hợp lý.
+        - Duy trì giọng điệu lịch sự, chuyên nghiệp nhưng gần gũi.
+
+        LƯU Ý: Luôn bám sát nguyên liệu và công thức đang thảo luận nếu có.
+        """
+    context_messages = [{"role": "system", "content": system_prompt}]
+    prompt_tokens = count_tokens(system_prompt) + count_tokens(question)
+    # Thêm lịch sử từ mới đến cũ cho tới khi hết ngân sách token (tối đa 8 lượt)
+    history = []
+    for msg in reversed(session['messages'].recent(8)):
+        question_tokens = count_tokens(msg.question)
+        answer = msg.answer
+        turn_tokens = question_tokens + count_tokens(answer)
+        if prompt_tokens + turn_tokens > CHAT_CONTEXT_TOKEN_BUDGET:
+            # Lượt cũ quá dài: thử giữ bản rút gọn của câu trả lời
+            answer = shorten_answer(msg.answer)
+            turn_tokens = question_tokens + count_tokens(answer)
+            if prompt_tokens + turn_tokens > CHAT_CONTEXT_TOKEN_BUDGET:
+                break
+        prompt_tokens += turn_tokens
+        history.append((msg.question, answer))
+    for past_question, past_answer in reversed(history):
+        context_messages.append({"role": "user", "content": past_question})
+        context_messages.append({"role": "assistant", "content": past_answer})
+    # Add current question
+    context_messages.append({"role": "user", "content": question})
+    return context_messages, prompt_tokens
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+def count_tokens(text):
+    """
+    Ước lượng số token: mỗi từ/âm tiết hoặc dấu câu tính là một token,
+    từ dài hơn 6 ký tự tính thêm (tokenizer thường tách thành nhiều phần).
+    """
+    if not text:
+        return 0
+    return sum(1 + len(piece) // 6 for piece in _TOKEN_PATTERN.findall(text))
+
+def shorten_answer(answer):
+    """Rút gọn câu trả lời cũ để giữ ý chính trong context"""
+    if len(answer) <= CHAT_TURN_SUMMARY_CHARS:
+        return answer
+    return answer[:CHAT_TURN_SUMMARY_CHARS].rsplit(' ', 1)[0] + '...'
+
+def get_fallback_answer(question):
+    """Câu trả lời dự phòng theo từ khóa khi không gọi được LM Studio"""
+    # Fallback response based on question keywords
+    question_lower = question.lower()
+    fallback_answer = ""
+    if 'thời gian' in question_lower or 'bao lâu' in question_lower:
+        fallback_answer = 'Thời gian chuẩn bị khoảng 10 phút, nấu 15-20 phút. Tổng cộng khoảng 25-30 phút là xong nhé!'
+    elif 'lửa' in question_lower or 'nhiệt độ' in question_lower:
+        fallback_answer = 'Nên dùng lửa vừa khi xào thịt, lửa to khi đun sôi nước. Lưu ý đảo đều tay để không bị cháy!'
+    elif 'người' in question_lower or 'khẩu phần' in question_lower:
+        fallback_answer = 'Công thức này đủ cho 3-4 người ăn. Nếu muốn nhiều hơn thì nhân đôi nguyên liệu nhé!'
+    elif 'mẹo' in question_lower or 'ngon' in question_lower:
+        fallback_answer = 'Mẹo: ướp thịt kỹ trước khi nấu, rau củ không nên xào quá lâu để giữ độ giòn. Nêm nếm từ từ cho vừa miệng!'
+    elif 'dai' in question_lower and 'thịt' in question_lower:
+        fallback_answer = 'Để thịt không dai: ướp với chút muối và dầu ăn 15 phút trước khi nấu, không nấu quá lâu ở nhiệt độ cao!'
+    elif 'xanh' in question_lower and ('rau' in question_lower or 'cải' in question_lower):
+        fallback_answer = 'Để rau giữ màu xanh: cho rau vào khi nước đã sôi, nấu nhanh ở lửa to, vớt ra ngay khi chín tới!'
+    else:
+        fallback_answer = 'Dựa trên nguyên liệu và công thức hiện tại, tôi khuyên bạn nên chú ý đến độ chín của nguyên liệu và nêm nếm phù hợp. Nấu ăn cần kiên nhẫn và thử nếm để có món ăn ngon nhất!'
+    return fallback_answer
+
+def touch_chat_session(session_id):
+    """Lấy session và cập nhật last_activity, trả về None nếu không tồn tại"""
+    return session_store.touch(session_id)
+
+def save_chat_message(session_id, question, answer, touch=True):
+    """Lưu một lượt hỏi đáp vào session"""
+    session_store.append_message(session_id, {
+        'question': question,
+        'answer': answer,
+        'timestamp': datetime.now().isoformat()
+    }, touch=touch)
+
+def chat_completion(context_messages):
+    """Tham số chat.completions.create (stream) cho một lượt chat"""
+    return {
+        'model': model,
+        'messages': context_messages,
+        'stream': True,
+        'temperature': 0.7,
+        'max_tokens': 500
+    }
+
+def chat_stream_cancelled(session_id):
+    # Client ngắt kết nối: không lưu câu trả lời dở dang
+    chat_streams_cancelled.inc()
+    request_logger.info("🛑 Client disconnected, cancelling LM Studio generation - Session: %s", session_id)
+
+def chat_done_event(full_answer, prompt_tokens, frames):
+    return sse.event({'type': 'done', 'full_answer': full_answer, 'prompt_tokens': prompt_tokens, 'frames': frames.frames})
+
+FALLBACK_WORD_DELAY = 0.05  # Giây giữa các từ khi stream câu trả lời dự phòng
+
+def fallback_events(question):
+    """(câu trả lời dự phòng, frame chunk cho từng từ); handler chờ FALLBACK_WORD_DELAY giữa các frame"""
+    answer = get_fallback_answer(question)
+    return answer, [sse.event({'content': word + ' ', 'type': 'chunk'}) for word in answer.split(' ')]
+
+def fallback_done_event(answer):
+    return sse.event({'type': 'done', 'full_answer': answer, 'note': 'Fallback response'})
+
 @app.route('/chat-stream', methods=['POST'])
 def chat_stream():
     """Chat với streaming response và context memory"""
     data = request.get_json()
     session_id = data.get('session_id')
     question = data.get('question', '')
+    permit = None
+    if session_id and question:
+        try:
+            permit = llm_gateway.acquire('chat')
+        except LLMBusyError as busy:
+            return llm_busy_response(busy)
 
     @stream_with_context
     def generate_response():
         try:
             if not session_id or not question:
-                yield f"data: {json.dumps({'error': 'Missing session_id or question', 'type': 'error'})}\n\n"
+                yield error_event('Missing session_id or question')
                 return
             # Get session
-            with session_lock:
-                if session_id not in chat_sessions:
-                    yield f"data: {json.dumps({'error': 'Session not found or expired', 'type': 'error'})}\n\n"
-                    return
-                session = chat_sessions[session_id]
-                session['last_activity'] = datetime.now()
-            # Build context from previous messages
-            ingredients_text = ', '.join(session['ingredients']) if session['ingredients'] else "các nguyên liệu có sẵn"
-            recipe_context = session['recipe'][:400] if session['recipe'] else ""
-            system_prompt = f"""
-                Bạn là một chuyên gia ẩm thực Việt Nam chuyên nghiệp. 
-                Bạn chỉ có thể trả lời các câu hỏi liên quan đến nấu ăn, nguyên liệu, món ăn, công thức hoặc mẹo vặt nhà bếp.
-
-                Nguyên liệu hiện có: {ingredients_text}
-                Công thức đang thảo luận: {recipe_context}
-
-                QUY TẮC BẮT BUỘC:
-                - Bạn TUYỆT ĐỐI KHÔNG được trả lời bất kỳ nội dung nào ngoài nấu ăn, kể cả khi người dùng hỏi về lập trình, khoa học, game, hay bất kỳ lĩnh vực nào khác. Bạn chỉ được phép nói đúng câu: "Xin lỗi tôi chỉ có thể trả lời về nấu ăn. Nếu bạn có câu hỏi nào khác, hãy cho tôi biết."
-                - KHÔNG được suy luận hoặc trả lời bất kỳ thông tin nào ngoài lĩnh vực ẩm thực.
-                - Trả lời ngắn gọn, dễ hiểu, đúng trọng tâm, bằng tiếng Việt.
-                - KHÔNG dùng HTML, Markdown, hoặc ký tự đặc biệt.
-                - Trả lời theo dạng văn bản thường, không có định dạng phức tạp, xuống dòng hợp lý.
-                - Duy trì giọng điệu lịch sự, chuyên nghiệp nhưng gần gũi.
-
-                LƯU Ý: Luôn bám sát nguyên liệu và công thức đang thảo luận nếu có.
-                """
-            context_messages = [{"role": "system", "content": system_prompt}]
-            # Add previous conversation history (last 8 messages)
-            for msg in session['messages'][-8:]:
-                context_messages.append({"role": "user", "content": msg['question']})
-                context_messages.append({"role": "assistant", "content": msg['answer']})
-            # Add current question
-            context_messages.append({"role": "user", "content": question})
-            print(f"🤖 Streaming chat - Session: {session_id}, Question: {question[:50]}...")
+            session = touch_chat_session(session_id)
+            if session is None:
+                yield error_event('Session not found or expired')
+                return
+            context_messages, prompt_tokens = build_chat_context(session, question)
+            request_logger.info("🤖 Streaming chat - Session: %s, Prompt tokens: ~%d", session_id, prompt_tokens)
+            timings = LLMTimings()
             # Stream response từ LM Studio
             try:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=context_messages,
-                    stream=True,
-                    temperature=0.7,
-                    max_tokens=500
-                )
-                full_answer = ""
-                for chunk in response:
-                    if chunk.choices[0].delta.content:
-                        content = chunk.choices[0].delta.content
-                        full_answer += content
-                        yield f"data: {json.dumps({'content': content, 'type': 'chunk'})}\n\n"
+                response = client.chat.completions.create(**chat_completion(context_messages))
+                def deltas():
+                    for chunk in response:
+                        content = timings.delta(chunk)
+                        if content:
+                            yield content
+
+                frames = frame_coalescer()
+                try:
+                    yield from sse.stream_frames(deltas(), frames)
+                except GeneratorExit:
+                    chat_stream_cancelled(session_id)
+                    raise
+                finally:
+                    # Đóng kết nối tới LM Studio để nó dừng sinh token (thread đọc cũng dừng theo)
+                    response.close()
+                timings.finish()
                 # Save complete answer to session
-                with session_lock:
-                    if session_id in chat_sessions:
-                        chat_sessions[session_id]['messages'].append({
-                            'question': question,
-                            'answer': full_answer.strip(),
-                            'timestamp': datetime.now().isoformat()
-                        })
-                        chat_sessions[session_id]['last_activity'] = datetime.now()
-                yield f"data: {json.dumps({'type': 'done', 'full_answer': full_answer.strip()})}\n\n"
-                print("✅ Streaming response completed")
+                full_answer = frames.text().strip()
+                save_chat_message(session_id, question, full_answer)
+                yield chat_done_event(full_answer, prompt_tokens, frames)
+                request_logger.info("✅ Streaming response completed")
             except Exception as api_error:
-                print(f"❌ LM Studio API error: {str(api_error)}")
-                # Fallback response based on question keywords
-                question_lower = question.lower()
-                fallback_answer = ""
-                if 'thời gian' in question_lower or 'bao lâu' in question_lower:
-                    fallback_answer = 'Thời gian chuẩn bị khoảng 10 phút, nấu 15-20 phút. Tổng cộng khoảng 25-30 phút là xong nhé!'
-                elif 'lửa' in question_lower or 'nhiệt độ' in question_lower:
-                    fallback_answer = 'Nên dùng lửa vừa khi xào thịt, lửa to khi đun sôi nước. Lưu ý đảo đều tay để không bị cháy!'
-                elif 'người' in question_lower or 'khẩu phần' in question_lower:
-                    fallback_answer = 'Công thức này đủ cho 3-4 người ăn. Nếu muốn nhiều hơn thì nhân đôi nguyên liệu nhé!'
-                elif 'mẹo' in question_lower or 'ngon' in question_lower:
-                    fallback_answer = 'Mẹo: ướp thịt kỹ trước khi nấu, rau củ không nên xào quá lâu để giữ độ giòn. Nêm nếm từ từ cho vừa miệng!'
-                elif 'dai' in question_lower and 'thịt' in question_lower:
-                    fallback_answer = 'Để thịt không dai: ướp với chút muối và dầu ăn 15 phút trước khi nấu, không nấu quá lâu ở nhiệt độ cao!'
-                elif 'xanh' in question_lower and ('rau' in question_lower or 'cải' in question_lower):
-                    fallback_answer = 'Để rau giữ màu xanh: cho rau vào khi nước đã sôi, nấu nhanh ở lửa to, vớt ra ngay khi chín tới!'
-                else:
-                    fallback_answer = 'Dựa trên nguyên liệu và công thức hiện tại, tôi khuyên bạn nên chú ý đến độ chín của nguyên liệu và nêm nếm phù hợp. Nấu ăn cần kiên nhẫn và thử nếm để có món ăn ngon nhất!'
+                logger.error("❌ LM Studio API error: %s", api_error)
                 # Stream fallback answer word by word
-                words = fallback_answer.split(' ')
-                full_fallback = ""
-                for word in words:
-                    full_fallback += word + " "
-                    yield f"data: {json.dumps({'content': word + ' ', 'type': 'chunk'})}\n\n"
-                    time.sleep(0.05)  # Small delay for streaming effect
+                fallback_answer, chunks = fallback_events(question)
+                for frame in chunks:
+                    yield frame
+                    time.sleep(FALLBACK_WORD_DELAY)
                 # Save fallback to session
-                with session_lock:
-                    if session_id in chat_sessions:
-                        chat_sessions[session_id]['messages'].append({
-                            'question': question,
-                            'answer': fallback_answer,
-                            'timestamp': datetime.now().isoformat()
-                        })
-                yield f"data: {json.dumps({'type': 'done', 'full_answer': fallback_answer, 'note': 'Fallback response'})}\n\n"
+                save_chat_message(session_id, question, fallback_answer, touch=False)
+                yield fallback_done_event(fallback_answer)
         except Exception as e:
-            print(f"❌ Chat stream error: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e), 'type': 'error'})}\n\n"
-
-    return Response(
-        generate_response(),
-        mimetype='text/plain',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type'
-        }
-    )
+            logger.error("❌ Chat stream error: %s", e)
+            yield error_event(str(e))
+        finally:
+            if permit:
+                permit.release()
+
+    response = Response(generate_response(), mimetype=sse.MEDIA_TYPE, headers=SSE_HEADERS)
+    if permit:
+        response.call_on_close(permit.release)
+    return response
 
 @app.route('/get-chat-history/<session_id>', methods=['GET'])
 def get_chat_history(session_id):
     """Lấy lịch sử chat"""
     try:
-        with session_lock:
-            if session_id not in chat_sessions:
-                return jsonify({
-                    'error': 'Session not found',
-                    'success': False
-                }), 404
-            
-            session = chat_sessions[session_id]
-            
+        session = session_store.get(session_id)
+        if session is None:
+            return jsonify({
+                'error': 'Session not found',
+                'success': False
+            }), 404
+        
         return jsonify({
             'success': True,
             'session_id': session_id,
             'ingredients': session['ingredients'],
             'recipe': session['recipe'],
-            'messages': session['messages'],
+            'messages': session['messages'].to_list(include_archived=True),
             'created_at': session['created_at'].isoformat(),
             'last_activity': session['last_activity'].isoformat(),
-            'total_messages': len(session['messages'])
+            'total_messages': session['messages'].total()
         })
         
     except Exception as e:
@@ -587,19 +1478,17 @@ def get_chat_history(session_id):
 def end_chat(session_id):
     """Kết thúc session chat"""
     try:
-        with session_lock:
-            if session_id in chat_sessions:
-                del chat_sessions[session_id]
-                print(f"🗑️ Ended chat session: {session_id}")
-                return jsonify({
-                    'success': True,
-                    'message': 'Chat session ended'
-                })
-            else:
-                return jsonify({
-                    'error': 'Session not found',
-                    'success': False
-                }), 404
+        if session_store.delete(session_id):
+            request_logger.info("🗑️ Ended chat session: %s", session_id)
+            return jsonify({
+                'success': True,
+                'message': 'Chat session ended'
+            })
+        else:
+            return jsonify({
+                'error': 'Session not found',
+                'success': False
+            }), 404
                 
     except Exception as e:
         return jsonify({
@@ -609,54 +1498,224 @@ def end_chat(session_id):
 
 # ==================== HEALTH & INFO ENDPOINTS ====================
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if not background_started:
+        start_background_services()
+
+@app.before_request
+def reject_large_upload():
+    # Từ chối ngay theo Content-Length, trước khi đọc body
+    limit = app.config['MAX_CONTENT_LENGTH']
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({
+            'error': f'Upload too large (max {MAX_UPLOAD_MB:g}MB)',
+            'success': False,
+            'ingredients': []
+        }), 413
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    requests_total.inc(route, request.method, str(response.status_code))
+    started = g.get('request_started')
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, route)
+    return response
+
+REGISTRY.gauge('food_app_active_sessions', 'Active chat sessions', lambda: session_store.count())
+REGISTRY.gauge(
+    'food_app_cache_hits_total', 'Cache hits',
+    lambda: {('detect',): detect_cache.stats()['hits'], ('recipe',): recipe_cache.stats()['hits']},
+    labelnames=['cache'], kind='counter'
+)
+REGISTRY.gauge(
+    'food_app_cache_misses_total', 'Cache misses',
+    lambda: {('detect',): detect_cache.stats()['misses'], ('recipe',): recipe_cache.stats()['misses']},
+    labelnames=['cache'], kind='counter'
+)
+REGISTRY.gauge(
+    'food_app_cache_hit_ratio', 'Cache hit ratio',
+    lambda: {('detect',): detect_cache.stats()['hit_rate'], ('recipe',): recipe_cache.stats()['hit_rate']},
+    labelnames=['cache']
+)
+REGISTRY.gauge(
+    'food_app_detect_workers_idle', 'Idle detection worker processes',
+    lambda: detection_pool.stats()['idle'] if detection_pool else 0
+)
+REGISTRY.gauge(
+    'food_app_recipe_coalesced_total', 'Recipe requests served by an identical in-flight LM Studio call',
+    lambda: recipe_flights.stats()['coalesced'], kind='counter'
+)
+REGISTRY.gauge('food_app_llm_in_flight', 'LM Studio requests running', lambda: llm_gateway.stats()['in_flight'])
+REGISTRY.gauge('food_app_llm_queued', 'LM Studio requests waiting for a slot', lambda: llm_gateway.stats()['queued'])
+REGISTRY.gauge(
+    'food_app_llm_rejected_total', 'LM Studio requests rejected (queue full = 429, wait timeout = 503)',
+    lambda: {(reason,): count for reason, count in llm_gateway.stats()['rejected'].items()},
+    labelnames=['reason'], kind='counter'
+)
+REGISTRY.gauge(
+    'food_app_startup_seconds', 'Seconds spent in each startup phase (ready = process start to model ready)',
+    lambda: {(phase,): seconds for phase, seconds in startup_timings.items()},
+    labelnames=['phase']
+)
+REGISTRY.gauge('food_app_sessions_evicted_total', 'Chat sessions removed by cleanup', lambda: cleanup_stats['total_evicted'], kind='counter')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Metrics theo định dạng Prometheus"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+# Trạng thái LM Studio được cập nhật nền, health check chỉ đọc giá trị này
+lm_studio_state = {
+    'status': 'unknown',
+    'checked_at': None,
+    'models': []
+}
+
+def probe_lm_studio():
+    """Kiểm tra LM Studio định kỳ bằng models.list (không chạy completion)"""
+    probe_client = client.with_options(timeout=3, max_retries=0)
+    while True:
+        try:
+            models = probe_client.models.list()
+            lm_studio_state['models'] = [m.id for m in models.data]
+            lm_studio_state['status'] = 'connected'
+        except Exception as e:
+            lm_studio_state['status'] = f"disconnected: {str(e)}"
+        lm_studio_state['checked_at'] = datetime.now().isoformat()
+        time.sleep(LM_STUDIO_PROBE_INTERVAL)
+
+# ==================== BACKGROUND SERVICES ====================
+
+background_lock = threading.Lock()
+background_started = False
+
+def start_background_services():
+    """
+    Khởi động thread load model (hoặc worker pool), thread dọn session và thread kiểm tra LM Studio,
+    một lần cho mỗi process. Không chạy khi import: reloader của debug mode import module cả ở process cha
+    (chỉ theo dõi file) lẫn process con, nên chỉ process phục vụ request gọi hàm này
+    (__main__, lifespan của asgi.py, hoặc request đầu tiên với server WSGI khác).
+    """
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    threading.Thread(target=load_detector, name='yolo-loader', daemon=True).start()
+    threading.Thread(target=cleanup_old_sessions, name='session-cleanup', daemon=True).start()
+    threading.Thread(target=probe_lm_studio, name='lm-studio-probe', daemon=True).start()
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness: process còn phục vụ request"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness: 200 chỉ khi YOLO model đã load xong; 503 warming_up (kèm Retry-After) khi đang load,
+    503 failed kèm lỗi khi load lỗi để replica hỏng bị loại khỏi load balancer.
+    Trạng thái LM Studio chỉ được báo cáo, vì chat có câu trả lời dự phòng và mọi replica dùng chung LM Studio.
+    """
+    status = model_state['status']
+    response = jsonify({
+        'status': {'loading': 'warming_up'}.get(status, status),
+        'yolo_model_loaded': model_loaded,
+        'yolo_model_status': status,
+        'yolo_model_error': model_state['error'],
+        'lm_studio_status': lm_studio_state['status'],
+        'lm_studio_checked_at': lm_studio_state['checked_at'],
+        'active_sessions': session_store.count()
+    })
+    if status != 'ready':
+        response.status_code = 503
+        if status == 'loading':
+            response.headers['Retry-After'] = str(YOLO_LOADING_RETRY_AFTER)
+    return response
+
+def admin_denied():
+    """Response lỗi nếu request không có ADMIN_TOKEN hợp lệ (session_id đủ để đọc/kết thúc chat của người khác)"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled (set ADMIN_TOKEN)', 'success': False}), 403
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Invalid admin token', 'success': False}), 401
+    return None
+
+@app.route('/admin/sessions', methods=['GET'])
+def admin_sessions():
+    """Danh sách session có phân trang (?page=1&per_page=50), mới hoạt động trước; store chỉ đọc trang được hỏi"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(500, max(1, request.args.get('per_page', 50, type=int)))
+        total = session_store.count()
+        start = (page - 1) * per_page
+        sessions = session_store.list_sessions(start, per_page) if start < total else []
+        return jsonify({
+            'success': True,
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'sessions': [
+                {**summary, 'last_activity': summary['last_activity'].isoformat()}
+                for summary in sessions
+            ]
+        })
+    except Exception as e:
+        return jsonify({
+            'error': f'Server error: {str(e)}',
+            'success': False
+        }), 500
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint with session info"""
     try:
-        # Test LM Studio connection
-        lm_studio_status = "unknown"
-        try:
-            test_response = client.chat.completions.create(
-                model="google/gemma-3-1b",
-                messages=[{"role": "user", "content": "test"}],
-                max_tokens=1,
-                timeout=5
-            )
-            lm_studio_status = "connected"
-        except Exception as e:
-            lm_studio_status = f"disconnected: {str(e)}"
-        
-        # Session statistics
-        with session_lock:
-            active_sessions = len(chat_sessions)
-            session_stats = {
-                'active_sessions': active_sessions,
-                'sessions': [
-                    {
-                        'session_id': sid,
-                        'messages_count': len(data['messages']),
-                        'last_activity': data['last_activity'].isoformat(),
-                        'ingredients_count': len(data['ingredients'])
-                    }
-                    for sid, data in chat_sessions.items()
-                ]
-            }
+        # Chỉ đọc trạng thái đã cache, không gọi LM Studio và không liệt kê từng session
+        session_stats = {
+            'active_sessions': session_store.count(),
+            'backend': SESSION_BACKEND,
+            'cleanup': dict(cleanup_stats),
+            'journal': session_journal.stats() if session_journal else None
+        }
         
         return jsonify({
             'status': 'healthy',
             'yolo_model_loaded': model_loaded,
-            'lm_studio_status': lm_studio_status,
-            'lm_studio_url': 'http://localhost:1234/v1',
+            'yolo_model_status': model_state['status'],
+            'yolo_model_error': model_state['error'],
+            'startup_seconds': {phase: round(seconds, 3) for phase, seconds in startup_timings.items()},
+            'lm_studio_status': lm_studio_state['status'],
+            'lm_studio_checked_at': lm_studio_state['checked_at'],
+            'lm_studio_url': LM_STUDIO_URL,
             'session_stats': session_stats,
+            'detect_cache': detect_cache.stats(),
+            'recipe_cache': recipe_cache.stats(),
+            'detect_workers': detection_pool.stats() if detection_pool else None,
+            'llm_gateway': llm_gateway.stats(),
+            'recipe_flights': recipe_flights.stats(),
             'endpoints': [
                 'POST /detect - YOLO detection',
+                'POST /detect-batch - YOLO detection for multiple images',
+                'WS /detect-stream - Streaming detection from camera frames (asgi)',
                 'GET /classes - Get YOLO classes',
                 'POST /generate-recipe - Generate recipe',
+                'POST /generate-recipe-stream - Generate recipe with streaming',
                 'POST /start-chat - Start chat session',
                 'POST /chat-stream - Chat with streaming & context',
                 'GET /get-chat-history/<id> - Get chat history',
                 'DELETE /end-chat/<id> - End chat session',
-                'GET /health - Health check'
+                'GET /health - Health check',
+                'GET /health/live - Liveness probe',
+                'GET /health/ready - Readiness probe',
+                'GET /admin/sessions - Paginated session list',
+                'GET /metrics - Prometheus metrics'
             ]
         })
         
@@ -673,7 +1732,7 @@ def root():
         'name': 'Food Detection & Recipe API with Context Chat',
         'version': '2.0.0',
         'status': 'running',
-        'yolo_model': 'loaded' if model_loaded else 'failed',
+        'yolo_model': 'loaded' if model_loaded else model_state['status'],
         'features': [
             'YOLO ingredient detection',
             'LM Studio recipe generation',
@@ -684,10 +1743,12 @@ def root():
         'endpoints': {
             'detection': {
                 'POST /detect': 'Upload ảnh để detect nguyên liệu',
+                'POST /detect-batch': 'Upload nhiều ảnh (key: images) để detect và gộp nguyên liệu',
                 'GET /classes': 'Lấy danh sách classes YOLO có thể detect'
             },
             'recipe': {
-                'POST /generate-recipe': 'Tạo công thức từ nguyên liệu'
+                'POST /generate-recipe': 'Tạo công thức từ nguyên liệu',
+                'POST /generate-recipe-stream': 'Tạo công thức với streaming response'
             },
             'chat': {
                 'POST /start-chat': 'Bắt đầu session chat với context',
@@ -697,6 +1758,10 @@ def root():
             },
             'info': {
                 'GET /health': 'Health check',
+                'GET /health/live': 'Liveness probe',
+                'GET /health/ready': 'Readiness probe',
+                'GET /admin/sessions': 'Danh sách session (phân trang)',
+                'GET /metrics': 'Prometheus metrics',
                 'GET /': 'API information'
             }
         },
@@ -709,24 +1774,37 @@ def root():
     
     return jsonify(info)
 
+# Thời gian từ lúc bắt đầu import tới khi app sẵn sàng nhận request (chưa tính load model)
+startup_timings['import'] = time.perf_counter() - STARTUP_STARTED
+
 if __name__ == '__main__':
     print("🚀 Food Detection & Recipe API with Context Chat Starting...")
     print("=" * 60)
-    print(f"📁 YOLO Model: {'✅ Loaded' if model_loaded else '❌ Failed'}")
-    if model_loaded:
-        print(f"🏷️  Detected Classes: {list(yolo_model.names.values())}")
-    print(f"🤖 LM Studio URL: http://localhost:1234/v1")
+    print(f"📁 YOLO Model: {'✅ Loaded' if model_loaded else '🔄 Loading in background' if model_state['status'] == 'loading' else '❌ Failed'}")
+    print(f"⚙️  YOLO backend: {YOLO_BACKEND} (imgsz={YOLO_IMGSZ}, dynamic={YOLO_DYNAMIC}, half={YOLO_HALF}, int8={YOLO_INT8})")
+    if DETECT_WORKERS > 0:
+        print(f"🧮 Detect workers: {DETECT_WORKERS} processes x {DETECT_WORKER_THREADS} threads")
+    else:
+        print(f"🧮 Detect batching: batch={DETECT_BATCH_SIZE}, max wait={DETECT_BATCH_MAX_WAIT_MS}ms")
+    print(f"⏱️  Startup: {startup_timings['import']:.2f}s (model keeps loading, /detect returns 503 until ready)")
+    print(f"🤖 LM Studio URL: {LM_STUDIO_URL}")
     print("🌐 Server URL: http://localhost:5000")
     print("=" * 60)
     print("📋 Available Endpoints:")
     print("  POST /detect                    - YOLO ingredient detection")
+    print("  POST /detect-batch              - YOLO detection for multiple images")
+    print("  WS   /detect-stream             - Streaming detection (uvicorn asgi:app)")
     print("  GET  /classes                   - Get available classes")
     print("  POST /generate-recipe           - Generate recipe from ingredients")
+    print("  POST /generate-recipe-stream    - Generate recipe with streaming")
     print("  POST /start-chat                - Start chat session with context")
     print("  POST /chat-stream               - Chat with streaming response")
     print("  GET  /get-chat-history/<id>     - Get chat history")
     print("  DELETE /end-chat/<id>           - End chat session")
     print("  GET  /health                    - Health check")
+    print("  GET  /health/live, /health/ready - Liveness / readiness probes")
+    print("  GET  /admin/sessions            - Paginated session list")
+    print("  GET  /metrics                   - Prometheus metrics")
     print("  GET  /                          - API info")
     print("=" * 60)
     print("🆕 New Features:")
@@ -735,5 +1813,8 @@ if __name__ == '__main__':
     print("  ✅ Chat history storage")
     print("  ✅ Automatic session cleanup")
     print("=" * 60)
-    
+
+    # debug=True bật reloader: process cha chỉ theo dõi file, process con (WERKZEUG_RUN_MAIN=true) mới phục vụ request
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Metrics đơn giản theo định dạng text của Prometheus (không cần prometheus_client).
+
+Counter/Histogram có label, Gauge lấy giá trị từ callback lúc render.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join(f'{name}="{str(value)}"' for name, value in pairs)
+    return '{' + body + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labelvalues, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labelvalues -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labelvalues)
+            if data is None:
+                data = self.values[labelvalues] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((labels, list(data)) for labels, data in self.values.items())
+        for labelvalues, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, ('le', '+Inf'))} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {data[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {data[-1]}")
+        return lines
+
+
+class Gauge:
+    """
+    Metric tính lúc render: callback trả về số hoặc dict {labelvalues: số}.
+    kind='counter' cho các bộ đếm được giữ ở nơi khác (vd. hit/miss của cache).
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.callback()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for labelvalues, v in sorted(value.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        return self.register(Gauge(name, documentation, callback, labelnames, kind))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
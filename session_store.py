@@ -0,0 +1,537 @@
+"""
+Session store cho chat.
+
+- MemorySessionStore: lưu trong process, chia shard, mỗi shard một lock riêng
+  nên các request của những session khác nhau không tranh nhau một lock chung.
+  Có thể ghi kèm xuống ChatJournal (SQLite) để khôi phục session sau restart.
+- RedisSessionStore: lưu trên server nói giao thức Redis (Redis, Valkey, KeyDB,
+  hoặc server giả lập local khi test) để nhiều process API dùng chung session.
+
+Session là dict gồm: session_id, ingredients, recipe, messages, created_at, last_activity.
+`messages` là MessageHistory: ring buffer giới hạn số lượt hỏi đáp giữ trong RAM.
+Mọi thay đổi phải đi qua method của store (touch, append_message, delete...).
+"""
+import heapq
+import json
+import os
+import queue
+import threading
+import zlib
+from collections import deque
+from datetime import datetime
+
+
+class ChatMessage:
+    """Một lượt hỏi đáp, dùng __slots__ và timestamp dạng epoch cho gọn"""
+
+    __slots__ = ('question', 'answer', 'timestamp')
+
+    def __init__(self, question, answer, timestamp):
+        self.question = question
+        self.answer = answer
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_dict(cls, data):
+        timestamp = data.get('timestamp')
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        return cls(data['question'], data['answer'], timestamp or datetime.now().timestamp())
+
+    def to_dict(self):
+        return {
+            'question': self.question,
+            'answer': self.answer,
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat()
+        }
+
+
+class ArchiveWriter:
+    """
+    Thread nền ghi các lượt chat cũ xuống file archive (JSON lines), để append_message
+    không làm I/O đĩa khi đang giữ lock của shard. Thao tác được xử lý theo thứ tự đưa vào;
+    flush() chờ ghi xong trước khi đọc file.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='chat-archive', daemon=True)
+        self.thread.start()
+
+    def write(self, path, message):
+        self.queue.put(('write', path, message))
+
+    def discard(self, path):
+        self.queue.put(('discard', path, None))
+
+    def flush(self):
+        done = threading.Event()
+        self.queue.put(('flush', None, done))
+        done.wait()
+
+    def _run(self):
+        while True:
+            ops = [self.queue.get()]
+            # Gom các thao tác đang chờ, mỗi file chỉ mở một lần cho một loạt lượt chat liên tiếp
+            while True:
+                try:
+                    ops.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = {}
+            for kind, path, value in ops:
+                if kind == 'write':
+                    lines.setdefault(path, []).append(json.dumps(value.to_dict(), ensure_ascii=False) + '\n')
+                    continue
+                self._write(lines)
+                lines = {}
+                if kind == 'discard':
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                else:
+                    value.set()
+            self._write(lines)
+
+    @staticmethod
+    def _write(lines):
+        for path, chunk in lines.items():
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.writelines(chunk)
+            except OSError:
+                pass
+
+
+_archive_writer = None
+_archive_writer_lock = threading.Lock()
+
+
+def archive_writer():
+    """ArchiveWriter dùng chung, tạo khi có session đầu tiên cần archive"""
+    global _archive_writer
+    with _archive_writer_lock:
+        if _archive_writer is None:
+            _archive_writer = ArchiveWriter()
+        return _archive_writer
+
+
+class MessageHistory:
+    """
+    Ring buffer các lượt hỏi đáp, giữ tối đa `capacity` lượt gần nhất trong RAM.
+    Nếu có archive_path, lượt cũ bị đẩy ra được ghi nối (JSON lines) xuống file
+    (qua ArchiveWriter, ngoài lock của shard) để /get-chat-history vẫn trả về đầy đủ. Nếu có loader (session ghi vào ChatJournal),
+    lượt cũ đã nằm trong journal nên chỉ cần đếm, loader() trả về toàn bộ lịch sử.
+    """
+
+    __slots__ = ('items', 'archive_path', 'archived_count', 'loader')
+
+    def __init__(self, capacity=20, archive_path=None, messages=(), loader=None, archived_count=0):
+        self.items = deque(maxlen=max(1, capacity))
+        self.archive_path = None if loader else archive_path
+        self.archived_count = archived_count
+        self.loader = loader
+        for message in messages:
+            self.append(message)
+
+    def append(self, message):
+        if not isinstance(message, ChatMessage):
+            message = ChatMessage.from_dict(message)
+        if len(self.items) == self.items.maxlen:
+            if self.archive_path:
+                self._archive(self.items[0])
+            elif self.loader:
+                self.archived_count += 1
+        self.items.append(message)
+        return message
+
+    def _archive(self, message):
+        archive_writer().write(self.archive_path, message)
+        self.archived_count += 1
+
+    def recent(self, n):
+        """n lượt gần nhất (cũ -> mới)"""
+        if n >= len(self.items):
+            return list(self.items)
+        return list(self.items)[-n:]
+
+    def to_list(self, include_archived=False):
+        if include_archived and self.archived_count and self.loader:
+            return self.loader()
+        messages = []
+        if include_archived and self.archived_count:
+            archive_writer().flush()
+            with open(self.archive_path, encoding='utf-8') as f:
+                messages.extend(json.loads(line) for line in f if line.strip())
+        messages.extend(message.to_dict() for message in self.items)
+        return messages
+
+    def total(self):
+        return self.archived_count + len(self.items)
+
+    def discard_archive(self):
+        if self.loader:
+            self.archived_count = 0
+        elif self.archive_path and self.archived_count:
+            archive_writer().discard(self.archive_path)
+            self.archived_count = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class _Shard:
+    """
+    Một shard của memory store: dict session + min-heap (last_activity, session_id).
+    Mỗi lần touch đẩy thêm một entry mới vào heap; entry cũ được bỏ qua khi pop
+    (so với last_activity hiện tại), nên dọn dẹp chỉ tốn O(số entry đã hết hạn).
+    """
+
+    __slots__ = ('sessions', 'lock', 'expiry')
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.expiry = []
+
+    def index(self, session):
+        heapq.heappush(self.expiry, (session['last_activity'], session['session_id']))
+        # Heap chứa quá nhiều entry cũ (session được touch liên tục) thì dựng lại
+        if len(self.expiry) > 4 * len(self.sessions) + 64:
+            self.expiry = [(data['last_activity'], sid) for sid, data in self.sessions.items()]
+            heapq.heapify(self.expiry)
+
+
+class MemorySessionStore:
+    """
+    Session store trong RAM, chia shard theo session_id (lock striping).
+    Với journal, mọi thay đổi được ghi kèm (bất đồng bộ) xuống ChatJournal; session chưa có
+    trong RAM (sau restart) được đọc lại từ journal ở lần truy cập đầu tiên.
+    """
+
+    def __init__(self, shards=16, history_size=20, archive_dir='', journal=None, ttl_seconds=7200):
+        self.shards = [_Shard() for _ in range(max(1, shards))]
+        self.history_size = history_size
+        self.archive_dir = archive_dir
+        self.journal = journal
+        self.ttl = ttl_seconds
+        if archive_dir and journal is None:
+            os.makedirs(archive_dir, exist_ok=True)
+
+    def _shard_of(self, session_id):
+        return self.shards[zlib.crc32(session_id.encode()) % len(self.shards)]
+
+    def _history_loader(self, session_id):
+        return lambda: [
+            ChatMessage(question, answer, timestamp).to_dict()
+            for question, answer, timestamp in self.journal.messages(session_id)
+        ]
+
+    def create(self, session):
+        session_id = session['session_id']
+        if self.journal is not None:
+            session['messages'] = MessageHistory(self.history_size, messages=session['messages'],
+                                                 loader=self._history_loader(session_id))
+            self.journal.create(session)
+            for message in session['messages']:
+                self.journal.append(session_id, message)
+        else:
+            archive_path = os.path.join(self.archive_dir, f"{session_id}.jsonl") if self.archive_dir else None
+            session['messages'] = MessageHistory(self.history_size, archive_path, session['messages'])
+        shard = self._shard_of(session_id)
+        with shard.lock:
+            shard.sessions[session['session_id']] = session
+            shard.index(session)
+
+    def _restore(self, shard, session_id):
+        """Đọc session từ journal vào shard (gọi ngoài shard.lock), trả về session hoặc None"""
+        if self.journal is None:
+            return None
+        loaded = self.journal.load(session_id, self.history_size, since=datetime.now().timestamp() - self.ttl)
+        if loaded is None:
+            return None
+        session, rows, total = loaded
+        session['messages'] = MessageHistory(
+            self.history_size,
+            messages=[ChatMessage(question, answer, timestamp) for question, answer, timestamp in rows],
+            loader=self._history_loader(session_id),
+            archived_count=total - len(rows)
+        )
+        session['created_at'] = datetime.fromtimestamp(session['created_at'])
+        session['last_activity'] = datetime.fromtimestamp(session['last_activity'])
+        with shard.lock:
+            # Request khác có thể đã khôi phục trước
+            if session_id not in shard.sessions:
+                shard.sessions[session_id] = session
+                shard.index(session)
+            return shard.sessions[session_id]
+
+    def _lookup(self, session_id):
+        """Shard của session; session chưa có trong RAM thì thử khôi phục từ journal trước"""
+        shard = self._shard_of(session_id)
+        if self.journal is None:
+            return shard
+        with shard.lock:
+            if session_id in shard.sessions:
+                return shard
+        self._restore(shard, session_id)
+        return shard
+
+    def get(self, session_id):
+        shard = self._lookup(session_id)
+        with shard.lock:
+            return shard.sessions.get(session_id)
+
+    def touch(self, session_id):
+        """Cập nhật last_activity, trả về session hoặc None nếu không tồn tại"""
+        shard = self._lookup(session_id)
+        with shard.lock:
+            session = shard.sessions.get(session_id)
+            if session is not None:
+                session['last_activity'] = datetime.now()
+                shard.index(session)
+                if self.journal is not None:
+                    self.journal.touch(session_id, session['last_activity'].timestamp())
+            return session
+
+    def append_message(self, session_id, message, touch=True):
+        shard = self._lookup(session_id)
+        with shard.lock:
+            session = shard.sessions.get(session_id)
+            if session is None:
+                return False
+            message = session['messages'].append(message)
+            if touch:
+                session['last_activity'] = datetime.now()
+                shard.index(session)
+            if self.journal is not None:
+                self.journal.append(session_id, message, session['last_activity'].timestamp() if touch else None)
+            return True
+
+    def delete(self, session_id):
+        shard = self._lookup(session_id)
+        with shard.lock:
+            session = shard.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        if self.journal is not None:
+            self.journal.delete(session_id)
+        session['messages'].discard_archive()
+        return True
+
+    def count(self):
+        return sum(len(shard.sessions) for shard in self.shards)
+
+    def list_sessions(self, offset=0, limit=None):
+        """
+        Tóm tắt các session, mới hoạt động trước, bỏ qua offset session đầu và lấy tối đa limit
+        (None = tất cả). Mỗi shard (khóa từng shard một) chỉ giữ offset + limit session mới nhất.
+        """
+        def summary(sid, data):
+            return {
+                'session_id': sid,
+                'messages_count': data['messages'].total(),
+                'last_activity': data['last_activity'],
+                'ingredients_count': len(data['ingredients'])
+            }
+
+        by_activity = lambda item: item['last_activity']
+        summaries = []
+        for shard in self.shards:
+            with shard.lock:
+                if limit is None:
+                    summaries.extend(summary(sid, data) for sid, data in shard.sessions.items())
+                else:
+                    top = heapq.nlargest(offset + limit, shard.sessions.items(),
+                                         key=lambda item: item[1]['last_activity'])
+                    summaries.extend(summary(sid, data) for sid, data in top)
+        if limit is None:
+            return sorted(summaries, key=by_activity, reverse=True)[offset:]
+        return heapq.nlargest(offset + limit, summaries, key=by_activity)[offset:]
+
+    def expire(self, cutoff):
+        """
+        Xóa các session có last_activity trước cutoff, trả về số session bị xóa.
+        Chỉ pop các entry đầu heap đã quá cutoff, không duyệt toàn bộ session.
+        """
+        removed = []
+        for shard in self.shards:
+            with shard.lock:
+                expiry = shard.expiry
+                while expiry and expiry[0][0] < cutoff:
+                    last_activity, sid = heapq.heappop(expiry)
+                    session = shard.sessions.get(sid)
+                    # Entry cũ: session đã bị xóa hoặc đã được touch sau đó
+                    if session is None or session['last_activity'] != last_activity:
+                        continue
+                    removed.append(shard.sessions.pop(sid))
+        # Xóa file archive ngoài lock
+        for session in removed:
+            session['messages'].discard_archive()
+        if self.journal is not None:
+            # Compaction: xóa cả session hết hạn chưa được khôi phục vào RAM
+            self.journal.compact(cutoff.timestamp())
+        return len(removed)
+
+
+class RedisSessionStore:
+    """
+    Session store trên Redis.
+    Mỗi session là một hash (meta) + một list (messages), cả hai có TTL được gia hạn
+    khi có hoạt động. Sorted set `<prefix>index` theo last_activity dùng để đếm và dọn dẹp.
+    List messages được LTRIM để chỉ giữ `history_size` lượt gần nhất.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', ttl_seconds=7200, prefix='food-app:session:', history_size=20):
+        import redis  # Chỉ cần khi dùng backend redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = int(ttl_seconds)
+        self.history_size = max(1, history_size)
+        self.prefix = prefix
+        self.index_key = f"{prefix}index"
+
+    def _meta_key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def _messages_key(self, session_id):
+        return f"{self.prefix}{session_id}:messages"
+
+    def create(self, session):
+        session_id = session['session_id']
+        now = session['last_activity'].timestamp()
+        pipe = self.redis.pipeline()
+        pipe.hset(self._meta_key(session_id), mapping={
+            'ingredients': json.dumps(session['ingredients'] or [], ensure_ascii=False),
+            'recipe': session['recipe'] or '',  # Redis không nhận None
+            'created_at': session['created_at'].timestamp(),
+            'last_activity': now
+        })
+        pipe.delete(self._messages_key(session_id))
+        messages = list(session['messages'])[-self.history_size:]
+        if messages:
+            pipe.rpush(self._messages_key(session_id), *[json.dumps(m, ensure_ascii=False) for m in messages])
+            pipe.expire(self._messages_key(session_id), self.ttl)
+        pipe.expire(self._meta_key(session_id), self.ttl)
+        pipe.zadd(self.index_key, {session_id: now})
+        pipe.execute()
+
+    def get(self, session_id):
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self._meta_key(session_id))
+        pipe.lrange(self._messages_key(session_id), 0, -1)
+        meta, messages = pipe.execute()
+        if 'ingredients' not in meta:
+            return None
+        return {
+            'session_id': session_id,
+            'ingredients': json.loads(meta['ingredients']),
+            'recipe': meta['recipe'],
+            'messages': MessageHistory(self.history_size, messages=[json.loads(m) for m in messages]),
+            'created_at': datetime.fromtimestamp(float(meta['created_at'])),
+            'last_activity': datetime.fromtimestamp(float(meta['last_activity']))
+        }
+
+    def _touch(self, pipe, session_id, now):
+        pipe.hset(self._meta_key(session_id), 'last_activity', now)
+        pipe.expire(self._meta_key(session_id), self.ttl)
+        pipe.expire(self._messages_key(session_id), self.ttl)
+        pipe.zadd(self.index_key, {session_id: now})
+
+    def touch(self, session_id):
+        if not self.redis.exists(self._meta_key(session_id)):
+            return None
+        pipe = self.redis.pipeline()
+        self._touch(pipe, session_id, datetime.now().timestamp())
+        pipe.execute()
+        return self.get(session_id)
+
+    def append_message(self, session_id, message, touch=True):
+        if not self.redis.exists(self._meta_key(session_id)):
+            return False
+        pipe = self.redis.pipeline()
+        pipe.rpush(self._messages_key(session_id), json.dumps(message, ensure_ascii=False))
+        pipe.ltrim(self._messages_key(session_id), -self.history_size, -1)
+        if touch:
+            self._touch(pipe, session_id, datetime.now().timestamp())
+        else:
+            pipe.expire(self._messages_key(session_id), self.ttl)
+        pipe.execute()
+        return True
+
+    def delete(self, session_id):
+        pipe = self.redis.pipeline()
+        pipe.delete(self._meta_key(session_id), self._messages_key(session_id))
+        pipe.zrem(self.index_key, session_id)
+        deleted, _ = pipe.execute()
+        return deleted > 0
+
+    def count(self):
+        return self.redis.zcard(self.index_key)
+
+    def list_sessions(self, offset=0, limit=None):
+        """Một trang session theo index (mới hoạt động trước): ZREVRANGE rồi một pipeline cho cả trang"""
+        stop = -1 if limit is None else offset + limit - 1
+        session_ids = self.redis.zrevrange(self.index_key, offset, stop) if limit != 0 else []
+        if not session_ids:
+            return []
+        pipe = self.redis.pipeline()
+        for session_id in session_ids:
+            pipe.hmget(self._meta_key(session_id), 'ingredients', 'last_activity')
+            pipe.llen(self._messages_key(session_id))
+        replies = pipe.execute()
+        summaries = []
+        for session_id, (ingredients, last_activity), messages_count in zip(session_ids, replies[::2], replies[1::2]):
+            if ingredients is None:
+                continue  # Key đã hết hạn nhưng index chưa được dọn
+            summaries.append({
+                'session_id': session_id,
+                'messages_count': messages_count,
+                'last_activity': datetime.fromtimestamp(float(last_activity)),
+                'ingredients_count': len(json.loads(ingredients))
+            })
+        return summaries
+
+    def expire(self, cutoff):
+        """Key tự hết hạn nhờ TTL của Redis, ở đây chỉ dọn index và key còn sót"""
+        expired = self.redis.zrangebyscore(self.index_key, '-inf', cutoff.timestamp())
+        if not expired:
+            return 0
+        pipe = self.redis.pipeline()
+        for session_id in expired:
+            pipe.delete(self._meta_key(session_id), self._messages_key(session_id))
+        pipe.zrem(self.index_key, *expired)
+        pipe.execute()
+        return len(expired)
+
+
+def create_session_store(backend='memory', **options):
+    """Tạo session store theo cấu hình: 'memory' hoặc 'redis'"""
+    if backend == 'redis':
+        return RedisSessionStore(
+            url=options.get('redis_url', 'redis://localhost:6379/0'),
+            ttl_seconds=options.get('ttl_seconds', 7200),
+            prefix=options.get('prefix', 'food-app:session:'),
+            history_size=options.get('history_size', 20)
+        )
+    if backend == 'memory':
+        journal = None
+        if options.get('journal_path'):
+            from chat_journal import ChatJournal
+            journal = ChatJournal(
+                options['journal_path'],
+                commit_interval_ms=options.get('journal_commit_ms', 50),
+                max_batch=options.get('journal_batch', 256)
+            )
+        return MemorySessionStore(
+            shards=options.get('shards', 16),
+            history_size=options.get('history_size', 20),
+            archive_dir=options.get('archive_dir', ''),
+            journal=journal,
+            ttl_seconds=options.get('ttl_seconds', 7200)
+        )
+    raise ValueError(f"Unknown session backend: {backend}")
@@ -0,0 +1,188 @@
+"""
+Gộp các request giống nhau đang chạy thành một lời gọi (single-flight).
+
+Request đầu tiên cho một key khởi chạy hàm produce ở nền (thread hoặc task asyncio,
+không gắn với kết nối của client nào, client ngắt thì những người khác vẫn nhận đủ);
+các request trùng key trong lúc đó chỉ đăng ký nhận kết quả. Flight giữ lại các chunk
+đã publish nên người đến sau vẫn stream được từ đầu, còn request không stream chỉ chờ
+kết quả cuối.
+"""
+import asyncio
+import threading
+
+
+class Flight:
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.admitted = False  # produce đã qua hàng đợi và bắt đầu chạy
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.async_waiters = []  # (loop, asyncio.Event) của các consumer async
+        self.task = None
+
+    def _notify(self):
+        # Gọi khi đang giữ condition
+        self.condition.notify_all()
+        waiters, self.async_waiters = self.async_waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def admit(self):
+        with self.condition:
+            self.admitted = True
+            self._notify()
+
+    def publish(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self._notify()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self._notify()
+
+    def text(self):
+        with self.condition:
+            return ''.join(self.chunks)
+
+    def _wait(self, predicate):
+        with self.condition:
+            self.condition.wait_for(predicate)
+
+    async def _await(self, predicate):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = asyncio.Event()
+            with self.condition:
+                if predicate():
+                    return
+                self.async_waiters.append((loop, event))
+            await event.wait()
+
+    def _admission(self):
+        if not self.admitted and self.error is not None:
+            raise self.error
+
+    def _next(self, index):
+        with self.condition:
+            chunks = self.chunks[index:]
+            if not chunks and self.error is not None:
+                raise self.error
+            return chunks
+
+    # Thread (Flask)
+
+    def wait_admitted(self):
+        """Chờ tới khi produce bắt đầu chạy; raise lỗi nếu bị từ chối trước đó (vd. 429/503)"""
+        self._wait(lambda: self.admitted or self.done)
+        self._admission()
+
+    def stream(self):
+        """Các chunk từ đầu tới khi xong"""
+        index = 0
+        while True:
+            self._wait(lambda: len(self.chunks) > index or self.done)
+            chunks = self._next(index)
+            if not chunks:
+                return
+            index += len(chunks)
+            yield from chunks
+
+    def result(self):
+        """Chờ xong và trả về toàn bộ nội dung"""
+        self._wait(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.text()
+
+    # asyncio (asgi.py)
+
+    async def await_admitted(self):
+        await self._await(lambda: self.admitted or self.done)
+        self._admission()
+
+    async def astream(self):
+        index = 0
+        while True:
+            await self._await(lambda: len(self.chunks) > index or self.done)
+            chunks = self._next(index)
+            if not chunks:
+                return
+            index += len(chunks)
+            for chunk in chunks:
+                yield chunk
+
+    async def aresult(self):
+        await self._await(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.text()
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        """Trả về (flight, True) nếu key chưa có flight (người gọi phải khởi chạy produce)"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self.flights[key] = Flight(key)
+            self.started += 1
+            return flight, True
+
+    def _complete(self, flight, error):
+        with self.lock:
+            self.flights.pop(flight.key, None)
+        flight.finish(error)
+
+    def run(self, key, produce):
+        """Tham gia flight của key, khởi chạy produce(flight) trên thread nền nếu chưa có. Trả về (flight, leader)"""
+        flight, leader = self._join(key)
+        if leader:
+            def target():
+                error = None
+                try:
+                    produce(flight)
+                except Exception as e:
+                    error = e
+                finally:
+                    self._complete(flight, error)
+            threading.Thread(target=target, daemon=True).start()
+        return flight, leader
+
+    def run_async(self, key, produce):
+        """Giống run() nhưng produce là coroutine function, chạy thành task trên event loop hiện tại"""
+        flight, leader = self._join(key)
+        if leader:
+            async def target():
+                error = None
+                try:
+                    await produce(flight)
+                except asyncio.CancelledError:
+                    error = RuntimeError('Generation cancelled')
+                    raise
+                except Exception as e:
+                    error = e
+                finally:
+                    self._complete(flight, error)
+            flight.task = asyncio.get_running_loop().create_task(target())
+        return flight, leader
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.flights),
+                'started': self.started,
+                'coalesced': self.coalesced
+            }
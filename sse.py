@@ -0,0 +1,152 @@
+"""
+Đóng gói Server-Sent Events cho các endpoint streaming (text/event-stream).
+
+Mỗi sự kiện là một dòng `data: <json>` và một dòng trống. Token từ LM Studio được gom
+thành frame (TokenCoalescer) theo cửa sổ thời gian/kích thước thay vì mỗi token một
+lần ghi socket. stream_frames/astream_frames gửi phần đang gom khi hết cửa sổ kể cả khi
+upstream đang dừng giữa hai token. JSON dùng orjson nếu có cài, nếu không dùng json.
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:  # Có trong requirements.txt; dùng json nếu môi trường không cài được orjson
+    orjson = None
+
+MEDIA_TYPE = 'text/event-stream'
+
+
+def dumps(payload):
+    """JSON dạng bytes UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def event(payload):
+    """Một sự kiện SSE (bytes)"""
+    return b'data: ' + dumps(payload) + b'\n\n'
+
+
+class TokenCoalescer:
+    """
+    Gom các delta thành frame {'type': 'chunk', 'content': ...}.
+    add() trả về frame khi đã qua interval_ms kể từ frame trước hoặc phần đang gom đạt max_chars;
+    phần còn giữ lại phải được flush() khi remaining() về 0 (xem stream_frames/astream_frames),
+    nên một delta không bị giữ quá interval_ms.
+    """
+
+    def __init__(self, interval_ms=30, max_chars=512):
+        self.interval = interval_ms / 1000.0
+        self.max_chars = max_chars
+        self.parts = []  # Toàn bộ nội dung đã nhận
+        self.pending = []  # Phần chưa gửi
+        self.pending_chars = 0
+        self.last_flush = 0.0
+        self.frames = 0
+
+    def add(self, content):
+        """Thêm một delta, trả về frame (bytes) nếu tới lúc gửi, None nếu còn gom"""
+        self.parts.append(content)
+        self.pending.append(content)
+        self.pending_chars += len(content)
+        if self.pending_chars >= self.max_chars or time.monotonic() - self.last_flush >= self.interval:
+            return self.flush()
+        return None
+
+    def remaining(self):
+        """Số giây tới hạn gửi phần đang gom, None nếu không có gì đang chờ"""
+        if not self.pending:
+            return None
+        return max(0.0, self.last_flush + self.interval - time.monotonic())
+
+    def flush(self):
+        """Frame cho phần đang gom (None nếu không còn gì)"""
+        if not self.pending:
+            return None
+        frame = event({'content': ''.join(self.pending), 'type': 'chunk'})
+        self.pending = []
+        self.pending_chars = 0
+        self.last_flush = time.monotonic()
+        self.frames += 1
+        return frame
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+class _Failure:
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+def stream_frames(deltas, coalescer):
+    """
+    Frame SSE cho một iterator delta chặn (vd. stream của OpenAI client).
+    Một thread đọc delta vào hàng đợi để hạn gửi được kiểm tra bằng timeout, không phải
+    chờ delta tiếp theo. Lỗi của iterator được raise lại ở đây.
+    """
+    items = queue.Queue()
+
+    def read():
+        try:
+            for delta in deltas:
+                items.put(delta)
+            items.put(_END)
+        except Exception as e:
+            items.put(_Failure(e))
+
+    threading.Thread(target=read, name='sse-reader', daemon=True).start()
+    while True:
+        try:
+            item = items.get(timeout=coalescer.remaining())
+        except queue.Empty:
+            yield coalescer.flush()
+            continue
+        if item is _END:
+            break
+        if isinstance(item, _Failure):
+            raise item.error
+        frame = coalescer.add(item)
+        if frame:
+            yield frame
+    frame = coalescer.flush()
+    if frame:
+        yield frame
+
+
+async def astream_frames(deltas, coalescer):
+    """Giống stream_frames cho async iterator: chờ delta tiếp theo tối đa tới hạn gửi"""
+    iterator = deltas.__aiter__()
+    next_delta = None
+    try:
+        while True:
+            if next_delta is None:
+                next_delta = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({next_delta}, timeout=coalescer.remaining())
+            if not done:
+                yield coalescer.flush()
+                continue
+            task, next_delta = next_delta, None
+            try:
+                delta = task.result()
+            except StopAsyncIteration:
+                break
+            frame = coalescer.add(delta)
+            if frame:
+                yield frame
+    finally:
+        if next_delta is not None:
+            next_delta.cancel()
+    frame = coalescer.flush()
+    if frame:
+        yield frame